@@ -0,0 +1,395 @@
+"""
+A size-generic packed board representation, for boards up to 8x8.
+
+The 2-bit cells used by encode.py only fit a 4x4 board into a 64-bit int, so here a board is
+stored as four bitplanes instead, each an unsigned 64-bit int with one bit per cell:
+
+    0. cells with a POS_45 filter
+    1. cells with a NEG_45 filter
+    2. cells covered by a horizontal domino
+    3. cells covered by a vertical domino
+
+Whatever the size of the board, cell (x, y) is bit `y * 8 + x`, so each row of the board is a
+byte of each plane. This makes the transforms cheap word-level operations: reflecting vertically
+reverses the bytes, reflecting horizontally reverses the bits in each byte, and transposing is
+the standard 8x8 bit matrix transpose. For boards smaller than 8x8 the result is shifted back to
+the top-left corner.
+
+Lights are encoded in the same way as the rest of the code base (2 bits per light, rows then
+columns, with the first row in the highest bits), and dominoes as multisets using the 4-bit
+counts from `encode.encode_dominoes`, so `encode.transforms_dominoes` applies to any size.
+
+The solver here (`search`) is the one used by `solve.solve` for boards of any size, and by the
+"quick" solve functions for boards larger than 4x4, where there are no precomputed tables.
+"""
+
+import numba as nb
+import numpy as np
+
+from polarize.encode import encode_dominoes, transforms_dominoes
+from polarize.model import Board, Filter, Orientation, placement_planes
+
+MAX_N = 8
+
+POS, NEG, H, V = range(4)
+
+# The number of lights that are blocked by a row or column, indexed by the bitwise or
+# of the filter values in it
+NUM_LIGHTS = np.array([0, 1, 1, 2], dtype=np.int64)
+
+
+def encode_bitboard(board):
+    """Encode a board (of any size up to 8x8) as an array of four bitplanes."""
+    assert board.n <= MAX_N
+    planes = np.zeros(4, dtype=np.uint64)
+    values = board.values
+    orientations = board.orientations
+    for y, x in zip(*np.nonzero(values)):
+        bit = np.uint64(1) << np.uint64(y * 8 + x)
+        planes[POS if values[y, x] == Filter.POS_45.value else NEG] |= bit
+        planes[H if orientations[y, x] == Orientation.H.value else V] |= bit
+    return planes
+
+
+def decode_bitboard(n, planes):
+    """Decode an array of four bitplanes to an n x n board."""
+    filters = orientations = 0
+    top = 2 * (n * n - 1)
+    pos, neg, h, v = (int(p) for p in planes)
+    for y in range(n):
+        for x in range(n):
+            bit = 1 << (y * 8 + x)
+            shift = top - 2 * (y * n + x)
+            if pos & bit:
+                filters |= Filter.POS_45.value << shift
+            elif neg & bit:
+                filters |= Filter.NEG_45.value << shift
+            if h & bit:
+                orientations |= Orientation.H.value << shift
+            elif v & bit:
+                orientations |= Orientation.V.value << shift
+    return Board.from_bits(n, filters, orientations)
+
+
+@nb.njit(nb.uint64(nb.uint64, nb.int64), cache=True)
+def reflect_plane_vertically(b, n):
+    """Reflect a bitplane of an n x n board vertically, by reversing the order of its rows (bytes)."""
+    b = ((b >> np.uint64(8)) & np.uint64(0x00FF00FF00FF00FF)) | (
+        (b & np.uint64(0x00FF00FF00FF00FF)) << np.uint64(8)
+    )
+    b = ((b >> np.uint64(16)) & np.uint64(0x0000FFFF0000FFFF)) | (
+        (b & np.uint64(0x0000FFFF0000FFFF)) << np.uint64(16)
+    )
+    b = (b >> np.uint64(32)) | (b << np.uint64(32))
+    return b >> np.uint64(8 * (MAX_N - n))
+
+
+@nb.njit(nb.uint64(nb.uint64, nb.int64), cache=True)
+def reflect_plane_horizontally(b, n):
+    """Reflect a bitplane of an n x n board horizontally, by reversing the bits in each row (byte)."""
+    b = ((b >> np.uint64(1)) & np.uint64(0x5555555555555555)) | (
+        (b & np.uint64(0x5555555555555555)) << np.uint64(1)
+    )
+    b = ((b >> np.uint64(2)) & np.uint64(0x3333333333333333)) | (
+        (b & np.uint64(0x3333333333333333)) << np.uint64(2)
+    )
+    b = ((b >> np.uint64(4)) & np.uint64(0x0F0F0F0F0F0F0F0F)) | (
+        (b & np.uint64(0x0F0F0F0F0F0F0F0F)) << np.uint64(4)
+    )
+    return b >> np.uint64(MAX_N - n)
+
+
+@nb.njit(nb.uint64(nb.uint64), cache=True)
+def transpose_plane(b):
+    """Transpose a bitplane (of any size), by swapping bits (x, y) and (y, x)."""
+    t = np.uint64(0x0F0F0F0F00000000) & (b ^ (b << np.uint64(28)))
+    b ^= t ^ (t >> np.uint64(28))
+    t = np.uint64(0x3333000033330000) & (b ^ (b << np.uint64(14)))
+    b ^= t ^ (t >> np.uint64(14))
+    t = np.uint64(0x5500550055005500) & (b ^ (b << np.uint64(7)))
+    b ^= t ^ (t >> np.uint64(7))
+    return b
+
+
+@nb.njit(nb.uint64[:](nb.uint64[:], nb.int64), cache=True)
+def reflect_vertically(planes, n):
+    """Reflect a board vertically, which swaps the filters (POS_45 and NEG_45)."""
+    out = np.empty(4, dtype=np.uint64)
+    out[POS] = reflect_plane_vertically(planes[NEG], n)
+    out[NEG] = reflect_plane_vertically(planes[POS], n)
+    out[H] = reflect_plane_vertically(planes[H], n)
+    out[V] = reflect_plane_vertically(planes[V], n)
+    return out
+
+
+@nb.njit(nb.uint64[:](nb.uint64[:], nb.int64), cache=True)
+def reflect_horizontally(planes, n):
+    """Reflect a board horizontally, which swaps the filters (POS_45 and NEG_45)."""
+    out = np.empty(4, dtype=np.uint64)
+    out[POS] = reflect_plane_horizontally(planes[NEG], n)
+    out[NEG] = reflect_plane_horizontally(planes[POS], n)
+    out[H] = reflect_plane_horizontally(planes[H], n)
+    out[V] = reflect_plane_horizontally(planes[V], n)
+    return out
+
+
+@nb.njit(nb.uint64[:](nb.uint64[:]), cache=True)
+def transpose(planes):
+    """Reflect a board in y=x, which swaps the orientations (H and V)."""
+    out = np.empty(4, dtype=np.uint64)
+    out[POS] = transpose_plane(planes[POS])
+    out[NEG] = transpose_plane(planes[NEG])
+    out[H] = transpose_plane(planes[V])
+    out[V] = transpose_plane(planes[H])
+    return out
+
+
+@nb.njit(nb.uint64[:, :](nb.uint64[:], nb.int64), cache=True)
+def transforms(planes, n):
+    """Return all the transforms of a board, in the same order as `Board.transforms`."""
+    out = np.empty((8, 4), dtype=np.uint64)
+    out[0] = planes
+    out[4] = transpose(planes)
+    for i in (0, 4):
+        # rotate through 90 degrees by transposing then reflecting vertically
+        for j in range(i + 1, i + 4):
+            out[j] = reflect_vertically(transpose(out[j - 1]), n)
+    return out
+
+
+@nb.njit(nb.boolean(nb.uint64[:], nb.uint64[:]), cache=True)
+def _planes_lt(a, b):
+    for i in range(4):
+        if a[i] != b[i]:
+            return a[i] < b[i]
+    return False
+
+
+@nb.njit(nb.uint64[:](nb.uint64[:], nb.int64), cache=True)
+def canonicalize_board(planes, n):
+    """Return the canonical form of a board: the minimum of its transforms, comparing planes in order."""
+    transformed = transforms(planes, n)
+    canonical = transformed[0]
+    for t in range(1, 8):
+        if _planes_lt(transformed[t], canonical):
+            canonical = transformed[t]
+    return canonical.copy()
+
+
+@nb.njit(nb.uint32(nb.uint64[:], nb.int64), cache=True)
+def lights_from_planes(planes, n):
+    """Return the encoded lights for a board."""
+    row_mask = np.uint64((1 << n) - 1)
+    col_mask = np.uint64(0)
+    for y in range(n):
+        col_mask |= np.uint64(1) << np.uint64(y * 8)
+    lights = 0
+    for i in range(n):  # rows
+        shift = np.uint64(i * 8)
+        num = 0
+        for f in (POS, NEG):
+            if (planes[f] >> shift) & row_mask:
+                num += 1
+        lights = (lights << 2) | num
+    for i in range(n):  # columns
+        shift = np.uint64(i)
+        num = 0
+        for f in (POS, NEG):
+            if (planes[f] >> shift) & col_mask:
+                num += 1
+        lights = (lights << 2) | num
+    return np.uint32(lights)
+
+
+@nb.njit(nb.int64[:](nb.uint32, nb.int64), cache=True)
+def _unpack_lights(val, n):
+    lights = np.empty(2 * n, dtype=np.int64)
+    for i in range(2 * n):
+        lights[i] = (val >> np.uint32(2 * (2 * n - 1 - i))) & np.uint32(0b11)
+    return lights
+
+
+@nb.njit(nb.uint32(nb.int64[:]), cache=True)
+def _pack_lights(lights):
+    val = 0
+    for li in lights:
+        val = (val << 2) | li
+    return np.uint32(val)
+
+
+@nb.njit(nb.uint32[:](nb.uint32, nb.int64), cache=True)
+def transforms_lights(val, n):
+    """Return all the transforms of the encoded lights, in the same order as `transforms`."""
+    out = np.empty(8, dtype=np.uint32)
+    lights = _unpack_lights(val, n)
+    for i in range(2):
+        rows, cols = lights[:n].copy(), lights[n:].copy()
+        if i == 1:
+            rows, cols = cols, rows  # transpose
+        for j in range(4):
+            out[i * 4 + j] = _pack_lights(np.concatenate((rows, cols)))
+            # rotate: transpose then reflect vertically (reversing the rows)
+            rows, cols = cols[::-1].copy(), rows
+    return out
+
+
+@nb.njit(
+    nb.types.Tuple((nb.uint32, nb.uint32))(nb.uint32, nb.uint32, nb.int64), cache=True
+)
+def canonicalize_puzzle(lights, dominoes, n):
+    """Return the canonical form of a puzzle on an n x n board, as in `encode.canonicalize_puzzle`."""
+    transformed_lights = transforms_lights(lights, n)
+    canonical_lights = transformed_lights.min()
+    transformed_dominoes = transforms_dominoes(dominoes)
+    canonical_dominoes = transformed_dominoes[
+        transformed_lights == canonical_lights
+    ].min()
+    return canonical_lights, canonical_dominoes
+
+
+@nb.njit(cache=True)
+def search(n, lights, dominoes, fewer_pieces_allowed, limit, placements):
+    """Find the boards that solve a puzzle, with a depth-first search.
+
+    If `fewer_pieces_allowed` is True then boards that use any sub-multiset of the dominoes
+    (including none of them) are found too, from the same search, since the dominoes are only
+    ever upper limits on what may be placed.
+
+    Cells are visited in order (across then down), and each empty cell is either left empty or
+    has one of the remaining domino types placed with its first filter there, pruning as soon as
+    a row or column blocks more lights than allowed, or a finished row doesn't block exactly the
+    right number. The search is iterative, with the choice made at each cell held in an array.
+
+    `placements` is the table from `model.placement_planes`. Returns an array of the solutions
+    as bitplanes, stopping once `limit` have been found (unless `limit` is negative).
+    """
+    num_cells = n * n
+    target = _unpack_lights(lights, n)
+    remaining = np.empty(8, dtype=np.int64)
+    num_remaining = 0
+    for t in range(8):
+        remaining[t] = (dominoes >> np.uint32(4 * (7 - t))) & np.uint32(0b1111)
+        num_remaining += remaining[t]
+
+    # the bitwise or of the filter values in each row, then each column
+    filters = np.zeros(2 * n, dtype=np.int64)
+    saved = np.zeros((num_cells, 4), dtype=np.int64)
+    # the domino type placed at each cell, or SKIPPED, or COVERED if another domino covers it
+    SKIPPED, COVERED = -1, -2
+    choice = np.full(num_cells + 1, SKIPPED, dtype=np.int64)
+
+    planes = np.zeros(4, dtype=np.uint64)
+    solutions = np.empty((16, 4), dtype=np.uint64)
+    num_solutions = 0
+
+    idx = 0
+    descending = True
+    while idx >= 0:
+        if descending:
+            y, x = idx // n, idx % n
+            ok = True
+            if x == 0 and y > 0 and NUM_LIGHTS[filters[y - 1]] != target[y - 1]:
+                ok = False  # the previous row is finished
+            elif idx == num_cells:
+                if fewer_pieces_allowed or num_remaining == 0:
+                    columns_match = True
+                    for i in range(n, 2 * n):
+                        if NUM_LIGHTS[filters[i]] != target[i]:
+                            columns_match = False
+                    if columns_match:
+                        if num_solutions == len(solutions):
+                            solutions = np.concatenate(
+                                (solutions, np.empty_like(solutions))
+                            )
+                        solutions[num_solutions] = planes
+                        num_solutions += 1
+                        if num_solutions == limit:
+                            break
+                ok = False
+            elif not fewer_pieces_allowed and 2 * num_remaining > num_cells - idx:
+                ok = False  # not enough cells left for the remaining dominoes
+            if not ok:
+                idx -= 1
+                descending = False
+                continue
+
+            bit = np.uint64(1) << np.uint64(y * 8 + x)
+            if (planes[H] | planes[V]) & bit:
+                choice[idx] = COVERED
+            else:
+                choice[idx] = SKIPPED  # leave the cell empty first
+            idx += 1
+            continue
+
+        # backtracking to cell idx, so undo its choice and try the next one
+        c = choice[idx]
+        if c == COVERED:
+            idx -= 1
+            continue
+        y, x = idx // n, idx % n
+        b1 = np.uint64(1) << np.uint64(y * 8 + x)
+        if c >= 0:
+            x2, y2 = (x + 1, y) if placements[H, c, idx] else (x, y + 1)
+            for p in range(4):
+                planes[p] ^= placements[p, c, idx]
+            filters[y], filters[y2] = saved[idx, 0], saved[idx, 1]
+            filters[n + x], filters[n + x2] = saved[idx, 2], saved[idx, 3]
+            remaining[c] += 1
+            num_remaining += 1
+
+        occupied = planes[H] | planes[V]
+        t = c + 1
+        while t < 8:
+            mask = placements[H, t, idx] | placements[V, t, idx]
+            if remaining[t] > 0 and mask != 0:
+                x2, y2 = (x + 1, y) if placements[H, t, idx] else (x, y + 1)
+                if not occupied & mask:
+                    pos_cells = placements[POS, t, idx]
+                    f1 = 1 if pos_cells & b1 else 2
+                    f2 = 1 if pos_cells & ~b1 else 2
+                    saved[idx, 0], saved[idx, 1] = filters[y], filters[y2]
+                    saved[idx, 2], saved[idx, 3] = filters[n + x], filters[n + x2]
+                    filters[y] |= f1
+                    filters[y2] |= f2
+                    filters[n + x] |= f1
+                    filters[n + x2] |= f2
+                    if (
+                        NUM_LIGHTS[filters[y]] <= target[y]
+                        and NUM_LIGHTS[filters[y2]] <= target[y2]
+                        and NUM_LIGHTS[filters[n + x]] <= target[n + x]
+                        and NUM_LIGHTS[filters[n + x2]] <= target[n + x2]
+                    ):
+                        for p in range(4):
+                            planes[p] |= placements[p, t, idx]
+                        remaining[t] -= 1
+                        num_remaining -= 1
+                        break
+                    filters[y], filters[y2] = saved[idx, 0], saved[idx, 1]
+                    filters[n + x], filters[n + x2] = saved[idx, 2], saved[idx, 3]
+            t += 1
+
+        if t < 8:
+            choice[idx] = t
+            idx += 1
+            descending = True
+        else:
+            idx -= 1
+
+    return solutions[:num_solutions]
+
+
+def solve_puzzle(puzzle, *, fewer_pieces_allowed=False, limit=None):
+    """Find the solutions to a puzzle (of any size up to 8x8), as an array of bitplanes."""
+    assert puzzle.n <= MAX_N
+    lights = np.uint32(puzzle.lights_int)
+    dominoes = np.uint32(
+        encode_dominoes(np.array([d.value for d in puzzle.dominoes], dtype=np.int8))
+    )
+    return search(
+        puzzle.n,
+        lights,
+        dominoes,
+        fewer_pieces_allowed,
+        -1 if limit is None else limit,
+        placement_planes(puzzle.n),
+    )
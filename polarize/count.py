@@ -1,21 +1,111 @@
-from itertools import combinations_with_replacement
+from typing import NamedTuple
 
+import numba as nb
 import numpy as np
 
-from polarize.generate import all_boards_with_dominoes
-from polarize.model import ALL_DOMINOES
+from polarize.bitboard import MAX_N, canonicalize_puzzle, lights_from_planes
+from polarize.encode import domino_multisets, encode_dominoes, next_placement
+from polarize.model import placement_planes
+
+
+class PuzzleCounts(NamedTuple):
+    """The number of puzzles with a unique solution.
+
+    `raw` counts every puzzle, so puzzles that are rotations or reflections of one another
+    are all counted, while `distinct` counts each set of them once.
+    """
+
+    raw: int
+    distinct: int
 
 
 def count_puzzles(n, num_pieces):
-    # Note that this doesn't take symmetries into account (so it double counts)
-    count = 0
-    for dominoes in combinations_with_replacement(ALL_DOMINOES, num_pieces):
-        # find all the boards and lights for these dominoes
-        boards = list(all_boards_with_dominoes(n, dominoes))
-        lights = np.asarray([board.lights_int for board in boards])
-
-        # find unique lights
-        _, uc = np.unique_counts(lights)
-
-        count += np.count_nonzero(uc == 1)
-    return count
+    # Note that this doesn't take symmetries into account (so it double counts),
+    # see `puzzle_counts`
+    return puzzle_counts(n, num_pieces).raw
+
+
+def puzzle_counts(n, num_pieces):
+    """Count the puzzles on an n x n board with `num_pieces` that have a unique solution.
+
+    Every board for each multiset of dominoes is enumerated by the same search as
+    `encode.all_boards` (see `encode.next_placement`), but for any size of board, keeping
+    only the lights. A puzzle has a unique solution if its lights occur for exactly one board,
+    and the canonical forms of these puzzles are used to count the distinct ones. No boards
+    are materialized.
+    """
+    assert n <= MAX_N
+    multisets = domino_multisets(num_pieces)
+    planes = placement_planes(n)
+    masks = planes[2] | planes[3]  # the cells covered by each domino
+    raw, canonical_keys = _unique_puzzles(n, multisets, masks, planes[0], planes[1])
+    return PuzzleCounts(int(raw), len(np.unique(canonical_keys)))
+
+
+@nb.njit(cache=True)
+def _unique_puzzles(n, multisets, masks, pos_bits, neg_bits):
+    """Find the puzzles with a unique solution for each (sorted) multiset of dominoes.
+
+    Returns the number of puzzles with a unique solution, and the canonical key of each one.
+    """
+    num_pieces = multisets.shape[1]
+
+    raw = 0
+    keys = np.empty(1024, dtype=np.uint64)
+    num_keys = 0
+    lights = np.empty(1024, dtype=np.uint32)
+    planes = np.zeros(4, dtype=np.uint64)
+
+    positions = np.empty(num_pieces + 1, dtype=np.int64)
+    occupied = np.zeros(num_pieces + 1, dtype=np.uint64)
+    pos_planes = np.zeros(num_pieces + 1, dtype=np.uint64)
+    neg_planes = np.zeros(num_pieces + 1, dtype=np.uint64)
+
+    for m in range(multisets.shape[0]):
+        multiset = multisets[m]
+        dominoes_val = encode_dominoes(multiset)
+
+        # find the lights of every board
+        num_boards = 0
+        depth = 0
+        positions[0] = -1
+        while True:
+            found, depth = next_placement(
+                multiset,
+                masks,
+                pos_bits,
+                neg_bits,
+                depth,
+                positions,
+                occupied,
+                pos_planes,
+                neg_planes,
+            )
+            if not found:
+                break
+            if num_boards == len(lights):
+                lights = np.concatenate((lights, np.empty_like(lights)))
+            planes[0] = pos_planes[num_pieces]
+            planes[1] = neg_planes[num_pieces]
+            lights[num_boards] = lights_from_planes(planes, n)
+            num_boards += 1
+
+        # the puzzles with a unique solution are the lights that only occur once
+        sorted_lights = np.sort(lights[:num_boards])
+        for i in range(num_boards):
+            if (i > 0 and sorted_lights[i] == sorted_lights[i - 1]) or (
+                i < num_boards - 1 and sorted_lights[i] == sorted_lights[i + 1]
+            ):
+                continue
+            raw += 1
+            if num_keys == len(keys):
+                keys = np.concatenate((keys, np.empty_like(keys)))
+            canonical_lights, canonical_dominoes = canonicalize_puzzle(
+                sorted_lights[i], dominoes_val, n
+            )
+            keys[num_keys] = (np.uint64(canonical_lights) << np.uint64(32)) | np.uint64(
+                canonical_dominoes
+            )
+            num_keys += 1
+
+    return raw, keys[:num_keys]
@@ -1,45 +1,82 @@
-from itertools import product
+from functools import cache
 
+import numba as nb
 import numpy as np
 
-from polarize.model import Board, PlacedDomino
+from polarize.encode import encode_dominoes
+from polarize.model import (
+    ALL_DOMINOES,
+    count_lights,
+    lights_within,
+    placement_planes,
+    placement_table,
+)
 
 
 def puzzle_features(puzzle):
     """
     Compute various puzzle features, which can be used to characterize its difficulty.
     """
-    num_dominoes = len(puzzle.dominoes)
-    num_distinct_dominoes = len(set(puzzle.dominoes))
-    num_yellow_spots = np.count_nonzero(np.asarray(puzzle.lights) == 0)
-    total_num_valid_domino_places = sum(
-        num_valid_domino_places(puzzle, domino) for domino in puzzle.dominoes
+    return encoded_puzzle_features(
+        puzzle.n, puzzle.lights_int, _encode_dominoes(puzzle)
     )
-    total_candidate_boards = num_candidate_boards(puzzle)
+
+
+def encoded_puzzle_features(n, lights, dominoes):
+    """
+    Compute the features of a puzzle on an n x n board from its encoded lights and dominoes.
+
+    See `puzzle_features`.
+    """
+    masks, place_lights, offsets = _place_tables(n)
+    num_valid, num_candidates = _valid_places_and_candidate_boards(
+        n, np.uint32(lights), np.uint32(dominoes), masks, place_lights, offsets
+    )
+    counts = _domino_counts(dominoes)
 
     return dict(
-        num_dominoes=num_dominoes,
-        num_distinct_dominoes=num_distinct_dominoes,
-        num_yellow_spots=num_yellow_spots,
-        total_num_valid_domino_places=total_num_valid_domino_places,
-        total_candidate_boards=total_candidate_boards
+        num_dominoes=int(counts.sum()),
+        num_distinct_dominoes=int(num_distinct_dominoes(dominoes)),
+        num_yellow_spots=int(num_yellow_spots(lights, n)),
+        total_num_valid_domino_places=int(num_valid @ counts),
+        total_candidate_boards=int(num_candidates),
     )
 
 
+def num_yellow_spots(lights, n):
+    """Return the number of lights that aren't blocked at all, for the encoded lights of a puzzle
+    on an n x n board (or an array of them)."""
+    lights = np.asarray(lights, dtype=np.uint32)
+    count = np.zeros(lights.shape, dtype=np.int64)
+    for i in range(2 * n):
+        count += (lights >> (2 * i)) & 0b11 == 0
+    return count
+
+
+def num_distinct_dominoes(dominoes):
+    """Return the number of distinct dominoes in an encoded multiset of dominoes (or array of them)."""
+    dominoes = np.asarray(dominoes, dtype=np.uint32)
+    count = np.zeros(dominoes.shape, dtype=np.int64)
+    for i in range(len(ALL_DOMINOES)):
+        count += (dominoes >> (4 * i)) & 0b1111 != 0
+    return count
+
+
 def num_valid_domino_places(puzzle, domino):
     """
     The number of places that a given domino can be placed on a board by itself
     to be consistent with a given puzzle.
     """
-    num = 0
-    for coord in domino.places():
-        board = Board(n=puzzle.n)
-        y, x = coord
-        pd = PlacedDomino(domino, x, y)
-        board.add_domino(pd)
-        if np.all(board.lights <= puzzle.lights):
-            num += 1
-    return num
+    masks, place_lights, offsets = _place_tables(puzzle.n)
+    num_valid, _ = _valid_places_and_candidate_boards(
+        puzzle.n,
+        np.uint32(puzzle.lights_int),
+        np.uint32(0),
+        masks,
+        place_lights,
+        offsets,
+    )
+    return int(num_valid[domino.value])
 
 
 def num_candidate_boards(puzzle):
@@ -47,35 +84,121 @@ def num_candidate_boards(puzzle):
     The number of boards that are candidate solutions, built up from placed dominoes
     that are individually consistent.
     """
-    all_pds = []
-    for domino in puzzle.dominoes:
-        pds = list(valid_domino_places(puzzle, domino))
-        all_pds.append(pds)
-
-    valid_boards = set()
-    for placed_dominoes in product(*all_pds):
-        board = valid_board(puzzle.n, placed_dominoes)
-        if board is not None:
-            valid_boards.add(board)
-
-    return len(valid_boards)
+    features = encoded_puzzle_features(
+        puzzle.n, puzzle.lights_int, _encode_dominoes(puzzle)
+    )
+    return features["total_candidate_boards"]
 
 
 def valid_domino_places(puzzle, domino):
-    for coord in domino.places():
-        board = Board(n=puzzle.n)
-        y, x = coord
-        pd = PlacedDomino(domino, x, y)
-        board.add_domino(pd)
-        if np.all(board.lights <= puzzle.lights):
+    n = puzzle.n
+    lights_int = puzzle.lights_int
+    for pd, placement in placement_table(n).items():
+        if pd.domino == domino and lights_within(
+            count_lights(placement.light_filters), lights_int, 2 * n
+        ):
             yield pd
 
 
-def valid_board(n, placed_dominoes):
-    board = Board(n)
-    for pd in placed_dominoes:
-        if board.can_add(pd):
-            board.add_domino(pd)
+def _encode_dominoes(puzzle):
+    return encode_dominoes(np.array([d.value for d in puzzle.dominoes], dtype=np.int8))
+
+
+def _domino_counts(dominoes):
+    return np.array(
+        [(int(dominoes) >> (4 * (7 - i))) & 0b1111 for i in range(len(ALL_DOMINOES))],
+        dtype=np.int64,
+    )
+
+
+@cache
+def _place_tables(n):
+    """Return the cells covered (see `placement_planes`) and the lights blocked by each place
+    a domino can go on an n x n board.
+
+    The places for domino `i` are at indexes `offsets[i]` up to `offsets[i + 1]`.
+    """
+    planes = placement_planes(n)
+    covered = planes[2] | planes[3]
+    table = placement_table(n)  # ordered by domino
+    masks = [covered[pd.domino.value, pd.y * n + pd.x] for pd in table]
+    place_lights = [
+        count_lights(placement.light_filters) for placement in table.values()
+    ]
+    counts = np.bincount([pd.domino.value for pd in table], minlength=len(ALL_DOMINOES))
+    return (
+        np.array(masks, dtype=np.uint64),
+        np.array(place_lights, dtype=np.uint32),
+        np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+    )
+
+
+@nb.njit(cache=True)
+def _valid_places_and_candidate_boards(
+    n, lights, dominoes, masks, place_lights, offsets
+):
+    """Count the valid places for each domino, and the candidate boards for a puzzle.
+
+    A place is valid if the domino doesn't block more lights than the puzzle does on its own.
+    A candidate board is a set of valid places for the puzzle's dominoes that don't overlap,
+    so the number of candidate boards is counted with a depth-first search that picks the
+    places for identical dominoes in increasing order (each board is only counted once).
+    """
+    num_types = len(offsets) - 1
+
+    # the valid places, grouped by domino
+    valid = np.empty(len(masks), dtype=np.int64)
+    starts = np.empty(num_types, dtype=np.int64)
+    ends = np.empty(num_types, dtype=np.int64)
+    num_valid = np.zeros(num_types, dtype=np.int64)
+    k = 0
+    for t in range(num_types):
+        starts[t] = k
+        for p in range(offsets[t], offsets[t + 1]):
+            within = True
+            for shift in range(0, 4 * n, 2):
+                if (place_lights[p] >> shift) & 0b11 > (lights >> shift) & 0b11:
+                    within = False
+                    break
+            if within:
+                valid[k] = p
+                k += 1
+        ends[t] = k
+        num_valid[t] = ends[t] - starts[t]
+
+    # the domino to place at each step of the search, with identical dominoes adjacent
+    num_pieces = 0
+    for t in range(num_types):
+        num_pieces += (dominoes >> (4 * (7 - t))) & 0b1111
+    pieces = np.empty(num_pieces, dtype=np.int64)
+    i = 0
+    for t in range(num_types):
+        for _ in range((dominoes >> (4 * (7 - t))) & 0b1111):
+            pieces[i] = t
+            i += 1
+    if num_pieces == 0:
+        return num_valid, 1  # the empty board
+
+    num_candidates = 0
+    chosen = np.empty(num_pieces, dtype=np.int64)  # index into valid
+    occupied = np.zeros(num_pieces + 1, dtype=np.uint64)
+    i = 0
+    chosen[0] = starts[pieces[0]] - 1
+    while i >= 0:
+        chosen[i] += 1
+        if chosen[i] >= ends[pieces[i]]:
+            i -= 1
+            continue
+        mask = masks[valid[chosen[i]]]
+        if occupied[i] & mask:
+            continue
+        if i == num_pieces - 1:
+            num_candidates += 1
+            continue
+        occupied[i + 1] = occupied[i] | mask
+        i += 1
+        if pieces[i] == pieces[i - 1]:
+            chosen[i] = chosen[i - 1]
         else:
-            return None
-    return board
+            chosen[i] = starts[pieces[i]] - 1
+    return num_valid, num_candidates
@@ -2,41 +2,8 @@ import itertools
 
 import numba as nb
 import numpy as np
-import pandas as pd
-
-from polarize.model import (
-    ALL_DOMINOES,
-    Board,
-    Domino,
-    Filter,
-    Orientation,
-    PlacedDomino,
-    Puzzle,
-    decode_lights,
-)
-from polarize.util import cproduct_idx
-
 
-def _encode_bit_pairs(values):
-    shift = 15 * 2
-    val = 0
-    # cast to int64 so that val has same type
-    value_ints = values.astype(np.uint64)
-    for i in range(4):
-        for j in range(4):
-            val |= value_ints[i, j] << shift
-            shift -= 2
-    return val
-
-
-def _decode_bit_pairs(val):
-    shift = 15 * 2
-    values = np.zeros((4, 4), dtype=np.int8)
-    for i in range(4):
-        for j in range(4):
-            values[i, j] = val >> shift & 0b11
-            shift -= 2
-    return values
+from polarize.model import ALL_DOMINOES, Board, Puzzle, decode_lights, placement_table
 
 
 def encode_board(board):
@@ -46,40 +13,26 @@ def encode_board(board):
     Together, the two provide enough information to reconstruct the placed dominoes on the board.
     """
     assert board.n == 4
-    return (_encode_bit_pairs(board.values) << 32) | _encode_bit_pairs(
-        board.orientations
-    )
+    return np.uint64((board.filter_bits << 32) | board.orientation_bits)
 
 
 def decode_board(val):
     """Decode an unsigned 64-bit int representing filters and domino orientations
     to a board by unpacking bits."""
-    filters = _decode_bit_pairs(val >> 32)
-    orientations = _decode_bit_pairs(val & 0xFFFFFFFF)
-
-    # find placed dominoes from values and orientations
-    placed_dominoes = set()
-    scanned = np.zeros(
-        (4, 4), dtype=np.int8
-    )  # keep a list of positions that have been dealt with
-    for y in range(4):
-        for x in range(4):
-            orient = orientations[y, x]
-            if orientations[y, x] != 0 and scanned[y, x] == 0:
-                orient = Orientation(orientations[y, x])
-                if orient == Orientation.H:
-                    domino = Domino(
-                        orient, Filter(filters[y, x]), Filter(filters[y, x + 1])
-                    )
-                else:
-                    domino = Domino(
-                        orient, Filter(filters[y, x]), Filter(filters[y + 1, x])
-                    )
-                pd = PlacedDomino(domino, x, y)
-                scanned[pd.np_index] = 1
-                placed_dominoes.add(pd)
-
-    return Board(values=filters, placed_dominoes=placed_dominoes)
+    val = int(val)
+    return Board.from_bits(4, val >> 32, val & 0xFFFFFFFF)
+
+
+def encode_puzzles(puzzles):
+    """Encode a sequence of puzzles as arrays of encoded lights and dominoes."""
+    lights_vals = np.empty(len(puzzles), dtype=np.uint32)
+    dominoes_vals = np.empty(len(puzzles), dtype=np.uint32)
+    for i, puzzle in enumerate(puzzles):
+        lights_vals[i] = puzzle.lights_int
+        dominoes_vals[i] = encode_dominoes(
+            np.array([d.value for d in puzzle.dominoes], dtype=np.int8)
+        )
+    return lights_vals, dominoes_vals
 
 
 def decode_puzzle(lights_val, dominoes_val):
@@ -373,6 +326,34 @@ def transpose_lights(val):
     return (v << 8) | h
 
 
+@nb.njit(nb.uint32[:](nb.uint32), cache=True)
+def transforms_lights(val):
+    """Return all the transforms of the encoded lights, in the same order as `transforms`."""
+    horizontal_reflection = reflect_lights_horizontally(val)
+    vertical_reflection = reflect_lights_vertically(val)
+    transposition = transpose_lights(val)
+
+    rotated_90 = reflect_lights_horizontally(transposition)
+    rotated_180 = reflect_lights_vertically(horizontal_reflection)
+    rotated_270 = reflect_lights_vertically(transposition)
+
+    anti_transposition = reflect_lights_vertically(rotated_90)
+
+    return np.array(
+        [
+            val,
+            rotated_270,
+            rotated_180,
+            rotated_90,
+            transposition,
+            vertical_reflection,
+            anti_transposition,
+            horizontal_reflection,
+        ],
+        dtype=np.uint32,
+    )
+
+
 @nb.njit(nb.uint32(nb.int8[:]), cache=True)
 def encode_dominoes(dominoes):
     """Encode a multiset of dominoes from an array of domino indexes as an unsigned int by packing bits.
@@ -396,6 +377,25 @@ def decode_dominoes(val):
     return np.array(dominoes, dtype=np.int8)
 
 
+def num_dominoes(val):
+    """Return the number of dominoes in an encoded multiset of dominoes (or array of them)."""
+    val = np.asarray(val, dtype=np.uint32)
+    count = np.zeros_like(val)
+    for i in range(8):
+        count += val >> (i * 4) & 0b1111
+    return count
+
+
+@nb.njit(nb.boolean(nb.uint32, nb.uint32), cache=True)
+def is_sub_multiset(val, other):
+    """Return True if the encoded multiset of dominoes `val` is a sub-multiset of `other`."""
+    for i in range(8):
+        shift = i * 4
+        if (val >> shift) & 0b1111 > (other >> shift) & 0b1111:
+            return False
+    return True
+
+
 @nb.njit(nb.uint32(nb.uint32), cache=True)
 def reflect_dominoes_horizontally(val):
     """Reflect the encoded dominoes horizontally"""
@@ -465,106 +465,344 @@ def transpose_dominoes(val):
     )
 
 
-def all_boards(num_pieces):
-    """Return an array containing all the boards - and their corresponding lights and dominoes - containing `num_pieces`."""
-    product = itertools.product(range(len(ALL_DOMINOES)), repeat=num_pieces)
-    selections = np.array(list(product), dtype=np.int8)
-    return _all_boards(selections)
+@nb.njit(nb.uint32[:](nb.uint32), cache=True)
+def transforms_dominoes(val):
+    """Return all the transforms of the encoded dominoes, in the same order as `transforms`."""
+    horizontal_reflection = reflect_dominoes_horizontally(val)
+    vertical_reflection = reflect_dominoes_vertically(val)
+    transposition = transpose_dominoes(val)
+
+    rotated_90 = reflect_dominoes_horizontally(transposition)
+    rotated_180 = reflect_dominoes_vertically(horizontal_reflection)
+    rotated_270 = reflect_dominoes_vertically(transposition)
+
+    anti_transposition = reflect_dominoes_vertically(rotated_90)
+
+    return np.array(
+        [
+            val,
+            rotated_270,
+            rotated_180,
+            rotated_90,
+            transposition,
+            vertical_reflection,
+            anti_transposition,
+            horizontal_reflection,
+        ],
+        dtype=np.uint32,
+    )
+
+
+def encode_puzzle_keys(lights, dominoes):
+    """Pack encoded lights and dominoes into unsigned 64-bit keys, with the lights in the high 32 bits.
 
+    Sorting by key groups puzzles by their lights, then by their dominoes, so all the puzzles
+    with given lights form a contiguous range of keys (see `lights_key_range`).
+    """
+    lights = np.asarray(lights, dtype=np.uint64)
+    dominoes = np.asarray(dominoes, dtype=np.uint64)
+    return (lights << np.uint64(32)) | dominoes
 
-# The order is the same as the order in ALL_DOMINOES
-DOMINOES_FILTER1 = np.array([1, 1, 2, 2, 1, 1, 2, 2], dtype=np.int8)
-DOMINOES_FILTER2 = np.array([1, 2, 1, 2, 1, 2, 1, 2], dtype=np.int8)
-DOMINOES_ORIENTATION = np.array([1, 1, 1, 1, 2, 2, 2, 2], dtype=np.int8)
-DOMINOES_FILTER2_SHIFT = np.array([1, 1, 1, 1, 4, 4, 4, 4], dtype=np.int8)
 
+def lights_key_range(lights):
+    """Return the (inclusive) start and (exclusive) end of the puzzle keys with the given lights."""
+    lights = np.asarray(lights, dtype=np.uint64)
+    return lights << np.uint64(32), (lights + np.uint64(1)) << np.uint64(32)
 
-@nb.njit(
-    nb.types.Tuple((nb.uint64[:], nb.uint32[:], nb.uint32[:]))(nb.int8[:, :]),
-    locals={"filters": nb.uint64, "orientations": nb.uint64},
-    cache=True,
-)
-def _all_boards(selections):
-    num_selections = selections.shape[0]
-    length = selections.shape[1]
-    sizes = np.asarray([16] * length, dtype=np.int32)
-    tuples = cproduct_idx(sizes)
-
-    max_num_boards = len(tuples) * num_selections
-    boards = np.zeros(max_num_boards, dtype=np.uint64)
-    lights = np.zeros(max_num_boards, dtype=np.uint32)
-    dominoes = np.zeros(max_num_boards, dtype=np.uint32)
-
-    board_idx = 0
-    for i in range(len(tuples)):
-        for p in range(num_selections):
-            filters = 0
-            orientations = 0
-            valid_board = True
-
-            # set filters and orientations for this tuple/selection
-            for j in range(length):
-                sel = selections[p][j]
-
-                # check if either horizontal or vertical dominoes are out of bounds
-                if DOMINOES_ORIENTATION[sel] == 1 and (tuples[i, j] + 1) % 4 == 0:
-                    valid_board = False
-                    break
-                if DOMINOES_ORIENTATION[sel] == 2 and tuples[i, j] >= 12:
-                    valid_board = False
-                    break
 
-                # find the bit shifts for each filter
-                filter1_shift = (15 - tuples[i, j]) * 2
-                filter2_shift = (15 - (tuples[i, j] + DOMINOES_FILTER2_SHIFT[sel])) * 2
+# The number of boards in each chunk yielded by `iter_all_boards`
+DEFAULT_CHUNK_SIZE = 2**20
 
-                # if the bits at either filter 1 or 2 are not 0 then we have an overlap
-                if (filters >> filter1_shift) & 0b11 != 0 or (
-                    filters >> filter2_shift
-                ) & 0b11 != 0:
-                    valid_board = False
-                    break
 
-                # update the filters and orientations bits
-                filters |= DOMINOES_FILTER1[sel] << filter1_shift
-                filters |= DOMINOES_FILTER2[sel] << filter2_shift
-                orientations |= DOMINOES_ORIENTATION[sel] << filter1_shift
-                orientations |= DOMINOES_ORIENTATION[sel] << filter2_shift
+def domino_multisets(num_pieces):
+    """Return all the multisets of `num_pieces` dominoes, as an array with a row of sorted
+    domino values for each multiset."""
+    multisets = list(
+        itertools.combinations_with_replacement(range(len(ALL_DOMINOES)), num_pieces)
+    )
+    return np.array(multisets, dtype=np.int8).reshape(len(multisets), num_pieces)
+
+
+def _empty_boards(num_boards):
+    boards = np.empty(num_boards, dtype=np.uint64)
+    lights = np.empty(num_boards, dtype=np.uint32)
+    dominoes = np.empty(num_boards, dtype=np.uint32)
+    return boards, lights, dominoes
+
+
+def count_boards(num_pieces, parallel=False, canonical=False):
+    """Return the number of boards containing `num_pieces`, without materializing them."""
+    multisets = domino_multisets(num_pieces)
+    return int(np.sum(_count_boards_per_multiset(multisets, parallel, canonical)))
+
+
+def all_boards(num_pieces, parallel=False, canonical=False):
+    """Return an array containing all the boards - and their corresponding lights and dominoes - containing `num_pieces`.
+
+    If `parallel` is True then the boards are enumerated using all available cores.
+    If `canonical` is True then only canonical boards are returned (see `canonicalize_board`),
+    which is one board for each set of boards that are transforms of one another.
+    """
+    for chunk in iter_all_boards(
+        num_pieces, chunk_size=None, parallel=parallel, canonical=canonical
+    ):
+        return chunk
+    return _empty_boards(0)
+
+
+def iter_all_boards(
+    num_pieces, chunk_size=DEFAULT_CHUNK_SIZE, parallel=False, canonical=False
+):
+    """Yield all the boards - and their corresponding lights and dominoes - containing `num_pieces`,
+    in chunks of around `chunk_size` boards.
+
+    The boards are yielded in the same order as `all_boards`, but only one chunk is held in memory
+    at a time. If `chunk_size` is None then all the boards are yielded in a single chunk.
+
+    Chunks are made up of all the boards for whole multisets of dominoes, so a chunk only exceeds
+    `chunk_size` if the boards for a single multiset do not fit in it.
+
+    If `parallel` is True then the boards are enumerated using all available cores.
+    If `canonical` is True then only canonical boards are yielded.
+    """
+    multisets = domino_multisets(num_pieces)
+
+    # count the boards for each multiset so that each one can be written to its own
+    # slice of the output (possibly by a separate thread)
+    counts = _count_boards_per_multiset(multisets, parallel, canonical)
+    ends = np.cumsum(counts)
+    if chunk_size is None:
+        chunk_size = max(int(ends[-1]), 1)
+
+    start = 0
+    while start < len(multisets):
+        base = ends[start - 1] if start > 0 else 0
+        stop = max(np.searchsorted(ends, base + chunk_size, side="right"), start + 1)
+        offsets = ends[start:stop] - counts[start:stop] - base
+        num_boards = ends[stop - 1] - base
+        if num_boards > 0:
+            boards, lights, dominoes = _empty_boards(num_boards)
+            fill_boards = _fill_boards_parallel if parallel else _fill_boards
+            fill_boards(
+                multisets[start:stop], offsets, boards, lights, dominoes, canonical
+            )
+            yield boards, lights, dominoes
+        start = stop
+
+
+def _placement_tables():
+    """Return tables of the occupancy mask, filter bits and orientation bits for every
+    domino placed at every position (the index of its first cell) on the board.
+
+    These are arrays made from `model.placement_table`. Placements that are out of bounds
+    have an occupancy mask of zero.
+    """
+    masks = np.zeros((len(ALL_DOMINOES), 16), dtype=np.int64)
+    filters = np.zeros((len(ALL_DOMINOES), 16), dtype=np.uint64)
+    orientations = np.zeros((len(ALL_DOMINOES), 16), dtype=np.uint64)
+    for pd, placement in placement_table(4).items():
+        sel = pd.domino.value
+        pos = pd.y * 4 + pd.x
+        masks[sel, pos] = placement.mask
+        filters[sel, pos] = placement.filters
+        orientations[sel, pos] = placement.orientations
+    return masks, filters, orientations
+
+
+PLACEMENT_MASKS, PLACEMENT_FILTERS, PLACEMENT_ORIENTATIONS = _placement_tables()
+
+
+@nb.njit(cache=True)
+def next_placement(
+    multiset, masks, bits1, bits2, depth, positions, occupied, placed1, placed2
+):
+    """Advance a search for the boards with the given (sorted) multiset of dominoes to the next
+    board, returning whether one was found and the depth to pass to continue the search.
+
+    Start with a `depth` of 0 and `positions[0]` set to -1. The board found is
+    `placed1[len(multiset)]` and `placed2[len(multiset)]`.
+    """
+    num_pieces = len(multiset)
+    num_positions = masks.shape[1]
+    while depth >= 0:
+        if depth == num_pieces:
+            # all the dominoes have been placed, so backtrack after returning the board
+            return True, depth - 1
+
+        # find the next position that the domino at this depth can be placed in
+        sel = multiset[depth]
+        pos = positions[depth] + 1
+        while pos < num_positions and (
+            masks[sel, pos] == 0 or masks[sel, pos] & occupied[depth] != 0
+        ):
+            pos += 1
+        if pos == num_positions:
+            # no more positions, so backtrack
+            depth -= 1
+            continue
+
+        positions[depth] = pos
+        occupied[depth + 1] = occupied[depth] | masks[sel, pos]
+        placed1[depth + 1] = placed1[depth] | bits1[sel, pos]
+        placed2[depth + 1] = placed2[depth] | bits2[sel, pos]
+        depth += 1
+
+        # the next domino goes after this one if it is identical, otherwise anywhere
+        if depth < num_pieces and multiset[depth] == sel:
+            positions[depth] = pos
+        else:
+            positions[depth] = -1
+
+    return False, depth
+
+
+@nb.njit(cache=True)
+def _place_multiset(multiset, board_idx, boards, lights, dominoes, fill, canonical):
+    """Find all the boards with the given (sorted) multiset of dominoes, using `next_placement`.
+
+    If `fill` is True then the boards are written to the output arrays starting at `board_idx`.
+    If `canonical` is True then only canonical boards are counted or written.
+    Returns the index after the last board found.
+    """
+    num_pieces = len(multiset)
+    dominoes_val = encode_dominoes(multiset)
+
+    positions = np.empty(num_pieces + 1, dtype=np.int64)
+    occupied = np.zeros(num_pieces + 1, dtype=np.int64)
+    filters = np.zeros(num_pieces + 1, dtype=np.uint64)
+    orientations = np.zeros(num_pieces + 1, dtype=np.uint64)
+
+    depth = 0
+    positions[0] = -1
+    while True:
+        found, depth = next_placement(
+            multiset,
+            PLACEMENT_MASKS,
+            PLACEMENT_FILTERS,
+            PLACEMENT_ORIENTATIONS,
+            depth,
+            positions,
+            occupied,
+            filters,
+            orientations,
+        )
+        if not found:
+            break
+        val = (filters[num_pieces] << 32) | orientations[num_pieces]
+        if canonical and canonicalize_board(val) != val:
+            continue
+        if fill:
+            boards[board_idx] = val
+            lights[board_idx] = encode_lights_from_filters(filters[num_pieces])
+            dominoes[board_idx] = dominoes_val
+        board_idx += 1
+
+    return board_idx
+
+
+def _count_boards_per_multiset(multisets, parallel, canonical):
+    if parallel:
+        return _count_boards_per_multiset_parallel(multisets, canonical)
+    return _count_boards_per_multiset_serial(multisets, canonical)
+
+
+@nb.njit(cache=True)
+def _count_boards_per_multiset_serial(multisets, canonical):
+    boards, lights, dominoes = (
+        np.empty(0, dtype=np.uint64),
+        np.empty(0, dtype=np.uint32),
+        np.empty(0, dtype=np.uint32),
+    )
+    counts = np.zeros(len(multisets), dtype=np.int64)
+    for p in range(len(multisets)):
+        counts[p] = _place_multiset(
+            multisets[p], 0, boards, lights, dominoes, False, canonical
+        )
+    return counts
+
+
+@nb.njit(parallel=True, cache=True)
+def _count_boards_per_multiset_parallel(multisets, canonical):
+    boards, lights, dominoes = (
+        np.empty(0, dtype=np.uint64),
+        np.empty(0, dtype=np.uint32),
+        np.empty(0, dtype=np.uint32),
+    )
+    counts = np.zeros(len(multisets), dtype=np.int64)
+    for p in nb.prange(len(multisets)):
+        counts[p] = _place_multiset(
+            multisets[p], 0, boards, lights, dominoes, False, canonical
+        )
+    return counts
+
 
-            if valid_board:
-                val = (filters << 32) | orientations
-                boards[board_idx] = val
-                lights[board_idx] = encode_lights_from_filters(filters)
-                dominoes[board_idx] = encode_dominoes(selections[p])
-                board_idx += 1
+@nb.njit(cache=True)
+def _fill_boards(multisets, offsets, boards, lights, dominoes, canonical):
+    """Fill the `boards`, `lights` and `dominoes` arrays with valid boards.
+
+    The boards for each multiset are written starting at the corresponding index in `offsets`.
+    """
+    for p in range(len(multisets)):
+        _place_multiset(
+            multisets[p], offsets[p], boards, lights, dominoes, True, canonical
+        )
 
-    return boards[:board_idx], lights[:board_idx], dominoes[:board_idx]
+
+@nb.njit(parallel=True, cache=True)
+def _fill_boards_parallel(multisets, offsets, boards, lights, dominoes, canonical):
+    """Fill the `boards`, `lights` and `dominoes` arrays with valid boards, in parallel.
+
+    The boards for each multiset are written starting at the corresponding index in `offsets`.
+    """
+    for p in nb.prange(len(multisets)):
+        _place_multiset(
+            multisets[p], offsets[p], boards, lights, dominoes, True, canonical
+        )
 
 
 def canonical_boards(num_pieces):
     """Return an array containing all the canonical boards - and their corresponding lights and dominoes - containing `num_pieces`."""
 
-    boards, lights, dominoes = all_boards(num_pieces)
-    canonicalized_boards, indices, _, _ = np.unique_all(canonicalize_boards(boards))
-    return canonicalized_boards, lights[indices], dominoes[indices]
+    boards, lights, dominoes = all_boards(num_pieces, canonical=True)
+    order = np.argsort(boards)
+    return boards[order], lights[order], dominoes[order]
+
+
+def duplicated_sorted_keys(sorted_keys):
+    """Return a boolean array marking all the keys in a sorted array that occur more than once."""
+    same_as_next = sorted_keys[1:] == sorted_keys[:-1]
+    duplicated = np.zeros(len(sorted_keys), dtype=np.bool_)
+    duplicated[1:] = same_as_next
+    duplicated[:-1] |= same_as_next
+    return duplicated
+
+
+def duplicated_keys(keys):
+    """Return a boolean array marking all the keys that occur more than once.
+
+    This is equivalent to Pandas `duplicated` with `keep=False`, but works by sorting the keys
+    and comparing neighbours.
+    """
+    order = np.argsort(keys)
+    duplicated_sorted = duplicated_sorted_keys(keys[order])
+    duplicated = np.empty_like(duplicated_sorted)
+    duplicated[order] = duplicated_sorted
+    return duplicated
 
 
 def all_puzzles(num_pieces):
     """Compute all the puzzles containing `num_pieces`.
 
     Note that symmetries are _not_ taken into account, so puzzles that can be transformed into one another
-    will all be returned.
+    will all be returned. All the boards are held in memory, so for large numbers of pieces use
+    the index instead (see `index.build_index`), which is built in bounded memory.
     """
 
     board_vals, lights_vals, dominoes_vals = all_boards(num_pieces=num_pieces)
 
-    df = pd.DataFrame(
-        {"boards": board_vals, "lights": lights_vals, "dominoes": dominoes_vals}
-    )
-
-    # mark all duplicates ('keep=False') since these are puzzles for which the same lights and dominoes
-    # have different board values so they do not have unique solutions
-    duplicated = df.duplicated(["lights", "dominoes"], keep=False).to_numpy()
+    # mark all duplicates (not just the second and subsequent ones) since these are puzzles for which
+    # the same lights and dominoes have different board values so they do not have unique solutions
+    duplicated = duplicated_keys(encode_puzzle_keys(lights_vals, dominoes_vals))
 
     return duplicated, board_vals, lights_vals, dominoes_vals
 
@@ -585,82 +823,189 @@ def all_puzzles_with_unique_solution(num_pieces):
 
 @nb.njit(nb.types.Tuple((nb.uint32, nb.uint32))(nb.uint32, nb.uint32), cache=True)
 def canonicalize_puzzle(lights, dominoes):
-    horizontal_reflection = reflect_lights_horizontally(lights)
-    vertical_reflection = reflect_lights_vertically(lights)
-    transposition = transpose_lights(lights)
+    transformed_lights = transforms_lights(lights)
+    canonical_lights = min(transformed_lights)
 
-    rotated_90 = reflect_lights_horizontally(transposition)
-    rotated_180 = reflect_lights_vertically(horizontal_reflection)
-    rotated_270 = reflect_lights_vertically(transposition)
+    transformed_pieces = transforms_dominoes(dominoes)
 
-    anti_transposition = reflect_lights_vertically(rotated_90)
+    # to restrict transformed lights to all the canonical (minimum) lights in case there are ties
+    canonical_pieces = min(transformed_pieces[transformed_lights == canonical_lights])
 
-    transformed_lights = np.array(
-        [
-            lights,
-            rotated_270,
-            rotated_180,
-            rotated_90,
-            transposition,
-            vertical_reflection,
-            anti_transposition,
-            horizontal_reflection,
-        ],
-        dtype=np.uint64,
-    )
-    canonical_lights = min(transformed_lights)
+    return canonical_lights, canonical_pieces
 
-    horizontal_reflection = reflect_dominoes_horizontally(dominoes)
-    vertical_reflection = reflect_dominoes_vertically(dominoes)
-    transposition = transpose_dominoes(dominoes)
 
-    rotated_90 = reflect_dominoes_horizontally(transposition)
-    rotated_180 = reflect_dominoes_vertically(horizontal_reflection)
-    rotated_270 = reflect_dominoes_vertically(transposition)
+@nb.njit(
+    nb.types.Tuple((nb.uint32[:], nb.uint32[:]))(nb.uint32[:], nb.uint32[:]), cache=True
+)
+def canonicalize_puzzles(lights, dominoes):
+    canonical_lights = np.empty(lights.shape[0], dtype=np.uint32)
+    canonical_dominoes = np.empty(lights.shape[0], dtype=np.uint32)
+    for i in range(lights.shape[0]):
+        canonical_lights[i], canonical_dominoes[i] = canonicalize_puzzle(
+            lights[i], dominoes[i]
+        )
+    return canonical_lights, canonical_dominoes
 
-    anti_transposition = reflect_dominoes_vertically(rotated_90)
 
-    transformed_pieces = np.array(
-        [
-            dominoes,
-            rotated_270,
-            rotated_180,
-            rotated_90,
-            transposition,
-            vertical_reflection,
-            anti_transposition,
-            horizontal_reflection,
-        ],
-        dtype=np.uint32,
-    )
+@nb.njit(cache=True)
+def sub_puzzles_from_canonical_keys(starts, ends, canonical_keys, lights, dominoes):
+    """Find the canonical puzzles that have the same lights as puzzles, and a sub-multiset of their dominoes.
 
-    # to restrict transformed lights to all the canonical (minimum) lights in case there are ties
-    canonical_pieces = min(transformed_pieces[transformed_lights == canonical_lights])
+    For puzzle `i`, the candidate canonical puzzle keys are those at indexes `starts[i]` up to
+    `ends[i]`, which should all have the same canonical lights as the puzzle. A candidate matches if
+    one of its transforms has the same lights as the puzzle, and dominoes that are a sub-multiset of
+    the puzzle's dominoes.
 
-    return canonical_lights, canonical_pieces
+    Returns the number of matching candidates for each puzzle, and an array of the indexes of all
+    the matches, concatenated in puzzle order.
+    """
+    num_candidates = 0
+    for i in range(len(starts)):
+        num_candidates += ends[i] - starts[i]
+    counts = np.zeros(len(starts), dtype=np.int64)
+    matches = np.empty(num_candidates, dtype=np.int64)
+
+    num_matches = 0
+    for i in range(len(starts)):
+        first = num_matches
+        for c in range(starts[i], ends[i]):
+            transformed_lights = transforms_lights(np.uint32(canonical_keys[c] >> 32))
+            transformed_dominoes = transforms_dominoes(
+                np.uint32(canonical_keys[c] & 0xFFFFFFFF)
+            )
+            for t in range(8):
+                if transformed_lights[t] == lights[i] and is_sub_multiset(
+                    transformed_dominoes[t], dominoes[i]
+                ):
+                    matches[num_matches] = c
+                    num_matches += 1
+                    break
+        counts[i] = num_matches - first
 
+    return counts, matches[:num_matches]
 
-def canonical_puzzles_with_unique_solution(num_pieces):
-    """Compute all canonical puzzles with a unique solution containing `num_pieces`, taking symmetries into account."""
 
-    _, single_solution_lights, single_solution_dominoes = (
-        all_puzzles_with_unique_solution(num_pieces)
-    )
-    n_puzzles = len(single_solution_lights)
+@nb.njit(cache=True)
+def _matching_transforms(candidate_dominoes, dominoes, fewer_pieces_allowed):
+    """Return which transforms of a candidate's dominoes match a puzzle's dominoes.
 
-    canonical_lights = np.empty(n_puzzles, dtype=np.uint32)
-    canonical_dominoes = np.empty(n_puzzles, dtype=np.uint32)
-    for i, (lights, dominoes) in enumerate(
-        zip(single_solution_lights, single_solution_dominoes)
-    ):
-        canonical_lights[i], canonical_dominoes[i] = canonicalize_puzzle(
-            lights, dominoes
-        )
+    If `fewer_pieces_allowed` is True then a sub-multiset of the puzzle's dominoes matches.
+    """
+    transformed_dominoes = transforms_dominoes(candidate_dominoes)
+    matches = np.zeros(8, dtype=np.bool_)
+    for t in range(8):
+        if fewer_pieces_allowed:
+            matches[t] = is_sub_multiset(transformed_dominoes[t], dominoes)
+        else:
+            matches[t] = transformed_dominoes[t] == dominoes
+    return matches
+
+
+@nb.njit(cache=True)
+def solutions_from_canonical_boards(
+    starts,
+    ends,
+    canonical_boards,
+    canonical_dominoes,
+    lights,
+    dominoes,
+    fewer_pieces_allowed=False,
+    limit=-1,
+    store=True,
+):
+    """Find the solutions to puzzles from the canonical boards that solve their canonical puzzles.
+
+    For puzzle `i`, the candidate canonical boards (and their dominoes) are those at indexes
+    `starts[i]` up to `ends[i]`. Each transform of a candidate that has the same lights and dominoes
+    as the puzzle is a solution. If `fewer_pieces_allowed` is True, then a transform whose dominoes
+    are a sub-multiset of the puzzle's dominoes is a solution too.
+
+    The search for each puzzle stops as soon as `limit` solutions have been found, unless `limit`
+    is negative. Returns the number of solutions for each puzzle, and an array of all the solutions,
+    concatenated in puzzle order (which is empty if `store` is False).
+    """
+    # the solutions are stored for every puzzle, or for one puzzle at a time if not storing them
+    size = 0
+    for i in range(len(starts)):
+        max_solutions = (ends[i] - starts[i]) * 8
+        if limit >= 0:
+            max_solutions = min(max_solutions, limit)
+        size = size + max_solutions if store else max(size, max_solutions)
+    counts = np.zeros(len(starts), dtype=np.int64)
+    solutions = np.empty(size, dtype=np.uint64)
+
+    num_solutions = 0
+    for i in range(len(starts)):
+        first = num_solutions if store else 0
+        num_solutions = first
+        for c in range(starts[i], ends[i]):
+            if num_solutions - first == limit:
+                break
+            matches = _matching_transforms(
+                canonical_dominoes[c], dominoes[i], fewer_pieces_allowed
+            )
+            if not np.any(matches):
+                continue  # avoid transforming the board
+            transformed_boards = transforms(canonical_boards[c])
+            for t in range(8):
+                board = transformed_boards[t]
+                if not matches[t]:
+                    continue
+                if encode_lights_from_filters(board >> 32) != lights[i]:
+                    continue
+                # symmetric boards are the same under more than one transform
+                seen = False
+                for s in range(first, num_solutions):
+                    if solutions[s] == board:
+                        seen = True
+                        break
+                if not seen:
+                    solutions[num_solutions] = board
+                    num_solutions += 1
+                    if num_solutions - first == limit:
+                        break
+        counts[i] = num_solutions - first
+
+    return counts, solutions[:num_solutions] if store else solutions[:0]
+
+
+def canonical_puzzles_with_unique_solution(num_pieces):
+    """Compute all canonical puzzles with a unique solution containing `num_pieces`, taking symmetries into account.
+
+    Only the canonical boards are enumerated (see `all_boards`), which is about 8 times fewer
+    than all the boards. A canonical puzzle has a unique solution if exactly one canonical board
+    has it, and that board has the same symmetries as its puzzle (otherwise a transform of the
+    board that leaves the puzzle unchanged would be a second solution).
+    """
 
-    # remove duplicate canonical puzzles
-    canonical_puzzles = np.stack((canonical_lights, canonical_dominoes), axis=1)
-    canonical_puzzles = np.unique(canonical_puzzles, axis=0)
-    canonical_lights = canonical_puzzles[:, 0]
-    canonical_dominoes = canonical_puzzles[:, 1]
+    boards, lights, dominoes = all_boards(num_pieces, canonical=True)
+    keys = encode_puzzle_keys(*canonicalize_puzzles(lights, dominoes))
+    order = np.argsort(keys)
+    keys = keys[order]
+    uniq = ~duplicated_sorted_keys(keys)
+    uniq &= _has_puzzle_symmetries(boards[order], lights[order], dominoes[order])
+    keys = keys[uniq]
 
+    canonical_lights = (keys >> np.uint64(32)).astype(np.uint32)
+    canonical_dominoes = (keys & np.uint64(0xFFFFFFFF)).astype(np.uint32)
     return canonical_lights, canonical_dominoes
+
+
+@nb.njit(cache=True)
+def _has_puzzle_symmetries(boards, lights, dominoes):
+    """Return a boolean array marking the boards that are unchanged by every transform that
+    leaves their puzzle unchanged."""
+    result = np.ones(len(boards), dtype=np.bool_)
+    for i in range(len(boards)):
+        board_transforms = transforms(boards[i])
+        lights_transforms = transforms_lights(lights[i])
+        dominoes_transforms = transforms_dominoes(dominoes[i])
+        for t in range(1, len(board_transforms)):
+            if (
+                lights_transforms[t] == lights[i]
+                and dominoes_transforms[t] == dominoes[i]
+                and board_transforms[t] != boards[i]
+            ):
+                result[i] = False
+                break
+    return result
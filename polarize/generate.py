@@ -1,45 +1,58 @@
-import random
+import multiprocessing
 
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
 from itertools import permutations, product
 
 import numpy as np
 
-from polarize.model import ALL_DOMINOES, Board, Orientation, PlacedDomino
+from polarize.difficulty import num_distinct_dominoes, num_yellow_spots
+from polarize.encode import decode_board, duplicated_sorted_keys, transforms
+from polarize.index import load_canonical_boards
+from polarize.model import (
+    ALL_DOMINOES,
+    Board,
+    Orientation,
+    PlacedDomino,
+    placement_table,
+)
+from polarize.storage import canonical_puzzle_key
 
 
-def _coord_lt(n, coord1, coord2):
-    y1, x1 = coord1
-    y2, x2 = coord2
-    return x1 + n * y1 < x2 + n * y2
+@cache
+def _places(n, domino):
+    """Return the position and placement of every place a domino can go on an n x n board."""
+    return [
+        (pd.y * n + pd.x, placement)
+        for pd, placement in placement_table(n).items()
+        if pd.domino == domino
+    ]
 
 
-def _coords_increasing(n, coords):
-    for i in range(len(coords) - 1):
-        if not _coord_lt(n, coords[i], coords[i + 1]):
-            return False
-    return True
+def _place_all(placements):
+    """Return the filter and orientation bits for placements with strictly increasing positions
+    that don't overlap, or None if there are none."""
+    prev_pos = -1
+    mask = filters = orientations = 0
+    for pos, placement in placements:
+        if pos <= prev_pos or mask & placement.mask:
+            return None
+        prev_pos = pos
+        mask |= placement.mask
+        filters |= placement.filters
+        orientations |= placement.orientations
+    return filters, orientations
 
 
 def all_boards_with_dominoes(n, dominoes):
     """Return all boards containing dominoes in every permutation."""
+    places = {domino: _places(n, domino) for domino in set(dominoes)}
     for domino_perm in set(permutations(domino for domino in dominoes)):
-        for coords in product(*(domino.places() for domino in domino_perm)):
-            # skip if coords are not strictly increasing (in pos)
-            if not _coords_increasing(n, coords):
-                continue
-
-            try:
-                board = Board(n=n)
-                for domino, coord in zip(domino_perm, coords):
-                    y, x = coord
-                    pd = PlacedDomino(domino, x, y)
-                    if board.can_add(pd):
-                        board.add_domino(pd)
-                    else:
-                        raise ValueError()
-                yield board
-            except ValueError:
-                pass  # try next coords
+        for placements in product(*(places[domino] for domino in domino_perm)):
+            bits = _place_all(placements)
+            if bits is not None:
+                yield Board.from_bits(n, *bits)
 
 
 def layout(n, dominoes):
@@ -52,34 +65,122 @@ def layout(n, dominoes):
         return 0 if domino.orientation is Orientation.V else 1
 
     sorted_dominoes = sorted(dominoes, key=sort_vert_first)
+    num_vertical = sum(1 for d in dominoes if d.orientation is Orientation.V)
+    positions = _layout_positions(n, num_vertical, len(dominoes) - num_vertical)
+    if positions is None:
+        return None
 
-    for coords in product(*(domino.places() for domino in sorted_dominoes)):
-        # skip if coords are not strictly increasing (in pos)
-        if not _coords_increasing(n, coords):
-            continue
+    table = placement_table(n)
+    placements = [
+        (pos, table[PlacedDomino(domino, pos % n, pos // n)])
+        for domino, pos in zip(sorted_dominoes, positions)
+    ]
+    return Board.from_bits(n, *_place_all(placements))
+
+
+@cache
+def _layout_positions(n, num_vertical, num_horizontal):
+    """Return the positions of the first cells of `num_vertical` vertical dominoes followed by
+    `num_horizontal` horizontal dominoes laid out on an n x n board, or None if they don't fit.
+    """
+    steps = [n] * num_vertical + [1] * num_horizontal  # to the domino's second cell
+    num_cells = n * n
+    # positions increase, so a search only depends on the cells from `start` onwards
+    failed = set()
+    positions = []
+
+    def search(i, start, occupied):
+        if i == len(steps):
+            return True
+        state = (i, start, occupied >> start)
+        if state in failed:
+            return False
+        free_cells = (num_cells - start) - (occupied >> start).bit_count()
+        if free_cells >= 2 * (len(steps) - i):
+            step = steps[i]
+            for pos in range(start, num_cells):
+                y, x = divmod(pos, n)
+                if (step == n and y == n - 1) or (step == 1 and x == n - 1):
+                    continue
+                mask = (1 << pos) | (1 << (pos + step))
+                if occupied & mask:
+                    continue
+                positions.append(pos)
+                if search(i + 1, pos + 1, occupied | mask):
+                    return True
+                positions.pop()
+        failed.add(state)
+        return False
+
+    return tuple(positions) if search(0, 0, 0) else None
+
+
+# The kinds of rejection counted by `generate`, and their descriptions
+REJECTIONS = {
+    "too_few_distinct_dominoes": "domino draws with too few distinct dominoes",
+    "too_many_yellow_spots": "candidate puzzles with too many yellow spots",
+    "no_candidates": "domino draws with no candidate puzzles",
+    "excluded": "puzzles that were excluded",
+    "not_unique": "puzzles without a unique solution when fewer pieces are allowed",
+}
+
+
+def _check_constraints(n, n_pieces, max_yellow_spots, min_distinct_dominoes):
+    # each domino blocks the lights of at most three rows and columns
+    min_yellow_spots = max(0, 2 * n - 3 * n_pieces)
+    if max_yellow_spots is not None and max_yellow_spots < min_yellow_spots:
+        raise ValueError(
+            f"Can't have fewer than {min_yellow_spots} yellow spots "
+            f"in a puzzle with {n_pieces} pieces on a {n}x{n} board"
+        )
+    if min_distinct_dominoes > min(n_pieces, len(ALL_DOMINOES)):
+        raise ValueError(
+            f"Can't have {min_distinct_dominoes} distinct dominoes "
+            f"in a puzzle with {n_pieces} pieces"
+        )
 
-        try:
-            board = Board(n=n)
-            for domino, coord in zip(sorted_dominoes, coords):
-                y, x = coord
-                pd = PlacedDomino(domino, x, y)
-                if board.can_add(pd):
-                    board.add_domino(pd)
-                else:
-                    raise ValueError()
-            return board
-        except ValueError:
-            pass  # try next coords
-
-
-def generate(n, n_pieces=None):
+
+def generate(
+    n,
+    n_pieces=None,
+    rng=None,
+    *,
+    max_yellow_spots=None,
+    min_distinct_dominoes=1,
+    exclude=None,
+    stats=None,
+):
+    """Generate a random puzzle with a unique solution (even when fewer pieces are allowed).
+
+    Random choices are made using `rng`, which may be a NumPy `Generator` or anything
+    that can seed one, such as an int or a `SeedSequence`.
+
+    The puzzle has at most `max_yellow_spots` (if set) and at least `min_distinct_dominoes`.
+    These are applied before any boards are found (for the dominoes) and before checking for
+    a unique solution (for the lights), so no work is wasted on puzzles that don't match.
+
+    If `exclude` is set, it is a collection of keys from `storage.canonical_puzzle_key`
+    (such as an `ArchiveIndex`), and the puzzle won't be the same as, or a rotation or
+    reflection of, any of them.
+
+    If `stats` is set, it is a `Counter` that is updated with the number of times each kind
+    of rejection happened on the way to the puzzle (see `REJECTIONS`).
+    """
     from polarize.solve import has_unique_solution
 
     n_pieces = n_pieces or 3
+    _check_constraints(n, n_pieces, max_yellow_spots, min_distinct_dominoes)
+    rng = np.random.default_rng(rng)
+    if stats is None:
+        stats = Counter()
 
     while True:
         # choose some dominoes
-        dominoes = random.choices(ALL_DOMINOES, k=n_pieces)
+        choices = rng.integers(len(ALL_DOMINOES), size=n_pieces)
+        if len(set(choices)) < min_distinct_dominoes:
+            stats["too_few_distinct_dominoes"] += 1
+            continue
+        dominoes = [ALL_DOMINOES[i] for i in choices]
 
         # find all the boards and lights for these dominoes
         boards = list(all_boards_with_dominoes(n, dominoes))
@@ -88,12 +189,18 @@ def generate(n, n_pieces=None):
         # find unique lights
         u, ui, uii, uc = np.unique_all(lights)
 
-        # check there are some unique puzzles
-        if np.count_nonzero(uc == 1) == 0:
+        # check there are some unique puzzles with few enough yellow spots
+        candidates = u[uc == 1]
+        if max_yellow_spots is not None:
+            few_yellow_spots = num_yellow_spots(candidates, n) <= max_yellow_spots
+            stats["too_many_yellow_spots"] += int(np.sum(~few_yellow_spots))
+            candidates = candidates[few_yellow_spots]
+        if len(candidates) == 0:
+            stats["no_candidates"] += 1
             continue
 
         # choose a random puzzle
-        li = np.random.choice(u[uc == 1])
+        li = rng.choice(candidates)
 
         inds = np.nonzero(lights == li)[0]
         assert len(inds) == 1
@@ -101,17 +208,152 @@ def generate(n, n_pieces=None):
         board = boards[ind]
 
         puzzle = board.to_puzzle()
+        if exclude is not None and canonical_puzzle_key(puzzle) in exclude:
+            stats["excluded"] += 1
+            continue
 
         # check it has a unique solution
         if has_unique_solution(puzzle, fewer_pieces_allowed=True):
             break
+        stats["not_unique"] += 1
 
     return puzzle, board
 
 
+@cache
+def unique_solution_boards(num_pieces):
+    """Return the canonical boards with `num_pieces` whose puzzles have a unique solution,
+    even when fewer pieces are allowed.
+
+    Returns the canonical puzzle keys, boards, lights and dominoes, in the same way as
+    `load_canonical_boards`. The boards come from the index (see index.py), so a puzzle key
+    that occurs more than once has more than one solution. The rest are checked against the
+    smaller tables (and for symmetric solutions) using `quick_count_solutions_many`.
+    """
+    from polarize.solve import quick_count_solutions_many
+
+    keys, boards, lights, dominoes = load_canonical_boards(num_pieces)
+    single = ~duplicated_sorted_keys(keys)
+    counts = quick_count_solutions_many(
+        lights[single], dominoes[single], fewer_pieces_allowed=True
+    )
+    unique = counts == 1
+    return tuple(arr[single][unique] for arr in (keys, boards, lights, dominoes))
+
+
+def generate_from_tables(
+    n,
+    n_pieces=None,
+    rng=None,
+    *,
+    max_yellow_spots=None,
+    min_distinct_dominoes=1,
+    exclude=None,
+):
+    """Generate a puzzle by choosing one at random from the precomputed tables.
+
+    A canonical puzzle with a unique solution is chosen uniformly, then a random transform of
+    it, so unlike `generate` there is no search and nothing to retry. Only 4x4 boards are
+    supported. See `generate` for the other arguments: since transforms don't change the
+    number of yellow spots or distinct dominoes, the constraints filter the table itself.
+    """
+    if n != 4:
+        raise ValueError("Puzzles can only be generated from tables for 4x4 boards")
+    n_pieces = n_pieces or 3
+    _check_constraints(n, n_pieces, max_yellow_spots, min_distinct_dominoes)
+    rng = np.random.default_rng(rng)
+
+    keys, boards, lights, dominoes = unique_solution_boards(n_pieces)
+    matches = num_distinct_dominoes(dominoes) >= min_distinct_dominoes
+    if max_yellow_spots is not None:
+        matches &= num_yellow_spots(lights, n) <= max_yellow_spots
+    if exclude is not None:
+        excluded = np.array(
+            [key for size, key in exclude if size == n], dtype=np.uint64
+        )
+        matches &= ~np.isin(keys, excluded)
+    boards = boards[matches]
+    if len(boards) == 0:
+        raise ValueError("No puzzles with a unique solution match the constraints")
+    board_val = transforms(boards[rng.integers(len(boards))])[rng.integers(8)]
+    board = decode_board(board_val)
+    return board.to_puzzle(), board
+
+
+def _generate_with_seed(n, n_pieces, from_tables, constraints, seed):
+    stats = Counter()
+    if from_tables:
+        # nothing is rejected, since the tables are filtered up front
+        puzzle, board = generate_from_tables(
+            n, n_pieces=n_pieces, rng=seed, **constraints
+        )
+    else:
+        puzzle, board = generate(
+            n, n_pieces=n_pieces, rng=seed, stats=stats, **constraints
+        )
+    return puzzle, board, stats
+
+
 def puzzle_generator(
     n,
     n_pieces=None,
+    from_tables=False,
+    *,
+    seed=None,
+    workers=1,
+    max_yellow_spots=None,
+    min_distinct_dominoes=1,
+    exclude=None,
+    stats=None,
 ):
-    while True:
-        yield generate(n, n_pieces=n_pieces)
+    """Yield an endless sequence of random puzzles (and their solutions).
+
+    The puzzles meet the constraints on `max_yellow_spots` and `min_distinct_dominoes`,
+    and aren't in `exclude`, see `generate`. If `stats` is set, it is a `Counter` that is
+    updated with the rejections made generating each puzzle as it is yielded.
+
+    Each puzzle is generated with its own seed, spawned in turn from a `SeedSequence` for
+    `seed`, so the sequence is the same for a given seed whatever the number of `workers`.
+    If `workers` is more than 1 then puzzles are generated in that many processes, keeping
+    a few tasks in flight for each one, and yielded in order.
+    """
+    seed_sequence = np.random.SeedSequence(seed)
+    constraints = dict(
+        max_yellow_spots=max_yellow_spots,
+        min_distinct_dominoes=min_distinct_dominoes,
+        exclude=exclude,
+    )
+
+    def task_args():
+        while True:
+            yield n, n_pieces, from_tables, constraints, seed_sequence.spawn(1)[0]
+
+    def result(puzzle, board, task_stats):
+        if stats is not None:
+            stats.update(task_stats)
+        return puzzle, board
+
+    if workers == 1:
+        for args in task_args():
+            yield result(*_generate_with_seed(*args))
+        return
+
+    # don't fork, since the parent may have numba threads running (and forkserver isn't
+    # available on all platforms)
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context("forkserver")
+    else:
+        mp_context = multiprocessing.get_context("spawn")
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=mp_context)
+    try:
+        tasks = task_args()
+        pending = deque(
+            executor.submit(_generate_with_seed, *next(tasks))
+            for _ in range(2 * workers)
+        )
+        while True:
+            future = pending.popleft()
+            pending.append(executor.submit(_generate_with_seed, *next(tasks)))
+            yield result(*future.result())
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
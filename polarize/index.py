@@ -0,0 +1,259 @@
+"""
+A persistent on-disk index of the precomputed puzzle tables from encode.py.
+
+Enumerating all the puzzles for a given number of pieces is expensive, so the tables
+are computed once, saved as NumPy arrays, and memory-mapped when they are loaded.
+The index is stored in a directory named after a hash of the source code that the tables
+are computed from (encode.py and model.py), so it is invalidated automatically whenever
+the encoding changes.
+
+Only canonical boards are stored (one for each set of boards that are transforms of one
+another), which makes the tables about 8 times smaller. Each board is keyed by the canonical
+form of its puzzle, packing its lights and dominoes (see `encode.encode_puzzle_keys`), and
+the tables are sorted by key so that the candidate boards for a puzzle can be found with a
+binary search rather than a scan of the whole table.
+
+The distinct keys are stored too, along with the offset of the first board for each of them.
+Since the lights are in the high bits of a key, this is an index of the domino multisets for
+each (canonical) lights value, which is used to find the puzzles with a sub-multiset of a
+puzzle's dominoes without scanning any boards.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from functools import cache
+from pathlib import Path
+
+import numba as nb
+import numpy as np
+
+from polarize import encode, model
+
+# Bump this whenever the layout of the files in the index changes
+INDEX_FORMAT_VERSION = 4
+
+ARRAY_NAMES = ("keys", "boards", "lights", "dominoes")
+ARRAY_DTYPES = (np.uint64, np.uint64, np.uint32, np.uint32)
+PUZZLE_KEY_ARRAY_NAMES = ("puzzle_keys", "puzzle_offsets")
+
+
+def cache_dir():
+    """Return the directory that indexes are stored in.
+
+    This can be overridden by setting the `POLARIZE_CACHE_DIR` environment variable.
+    """
+    if "POLARIZE_CACHE_DIR" in os.environ:
+        return Path(os.environ["POLARIZE_CACHE_DIR"])
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+    return Path(xdg_cache_home) / "polarize"
+
+
+def source_version(format_version, *modules):
+    """Return a version string that changes whenever `format_version` or the source code of
+    any of the given modules changes."""
+    h = hashlib.sha256()
+    h.update(str(format_version).encode())
+    for module in modules:
+        h.update(Path(module.__file__).read_bytes())
+    return h.hexdigest()[:16]
+
+
+@cache
+def encoding_version():
+    """Return a version string that changes whenever the encoding changes.
+
+    The tables are computed by the kernels in encode.py from the placements in model.py, so
+    this is a hash of the source code of both modules.
+    """
+    return source_version(INDEX_FORMAT_VERSION, encode, model)
+
+
+def index_path(num_pieces):
+    """Return the path of the index for puzzles containing `num_pieces`."""
+    return cache_dir() / encoding_version() / f"puzzles-{num_pieces}"
+
+
+def build_index(num_pieces, chunk_size=encode.DEFAULT_CHUNK_SIZE, parallel=False):
+    """Compute all the canonical boards containing `num_pieces` and save them to the index.
+
+    This is an external merge sort: boards are enumerated in chunks of `chunk_size`, and each
+    chunk is sorted by key and written to disk as a run. The runs are then merged into the
+    final (memory-mapped) arrays, so only around one chunk is held in memory at a time.
+    If `parallel` is True then boards are enumerated using all available cores.
+    """
+    path = index_path(num_pieces)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # write to a temporary directory then rename, so that concurrent processes
+    # never see a partially-written index
+    tmp_path = Path(tempfile.mkdtemp(dir=path.parent, prefix=f".{path.name}-"))
+    try:
+        num_boards = encode.count_boards(num_pieces, parallel=parallel, canonical=True)
+        runs = {
+            name: _open_memmap(tmp_path / f"run-{name}.npy", dtype, num_boards)
+            for name, dtype in zip(ARRAY_NAMES, ARRAY_DTYPES)
+        }
+        run_starts = [0]
+        for boards, lights, dominoes in encode.iter_all_boards(
+            num_pieces, chunk_size=chunk_size, parallel=parallel, canonical=True
+        ):
+            keys = encode.encode_puzzle_keys(
+                *encode.canonicalize_puzzles(lights, dominoes)
+            )
+            order = np.argsort(keys, kind="stable")
+            start, end = run_starts[-1], run_starts[-1] + len(keys)
+            for run, arr in zip(runs.values(), (keys, boards, lights, dominoes)):
+                run[start:end] = arr[order]
+            run_starts.append(end)
+            del keys, boards, lights, dominoes, order
+
+        columns = {
+            name: _open_memmap(tmp_path / f"{name}.npy", dtype, num_boards)
+            for name, dtype in zip(ARRAY_NAMES, ARRAY_DTYPES)
+        }
+        _merge_runs(np.array(run_starts), *runs.values(), *columns.values())
+        for column in columns.values():
+            column.flush()
+        del runs
+        for name in ARRAY_NAMES:
+            (tmp_path / f"run-{name}.npy").unlink()
+
+        _save_puzzle_keys(tmp_path, columns["keys"], chunk_size or num_boards)
+        del columns
+
+        os.rename(tmp_path, path)
+    except OSError:
+        # another process built the index first
+        if not path.exists():
+            raise
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return path
+
+
+def _open_memmap(path, dtype, length):
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(length,))
+
+
+@nb.njit(cache=True)
+def _merge_runs(
+    run_starts,
+    run_keys,
+    run_boards,
+    run_lights,
+    run_dominoes,
+    keys,
+    boards,
+    lights,
+    dominoes,
+):
+    """Merge the runs (from `run_starts[r]` to `run_starts[r + 1]`) that are each sorted by key
+    into the `keys`, `boards`, `lights` and `dominoes` columns, as a stable sort would."""
+    num_runs = len(run_starts) - 1
+    ends = run_starts[1:]
+    heap = np.empty(num_runs, dtype=np.int64)  # the next index in each run
+    size = 0
+    for r in range(num_runs):
+        if run_starts[r] < ends[r]:
+            heap[size] = run_starts[r]
+            size += 1
+    # the runs start in order, so comparing indexes breaks ties between equal keys
+    for i in range(size // 2 - 1, -1, -1):
+        _sift_down(heap, size, i, run_keys)
+
+    out = 0
+    while size > 0:
+        i = heap[0]
+        keys[out] = run_keys[i]
+        boards[out] = run_boards[i]
+        lights[out] = run_lights[i]
+        dominoes[out] = run_dominoes[i]
+        out += 1
+        # advance the run at the top of the heap, or remove it if it is exhausted
+        r = np.searchsorted(ends, i, side="right")
+        if i + 1 < ends[r]:
+            heap[0] = i + 1
+        else:
+            size -= 1
+            heap[0] = heap[size]
+        _sift_down(heap, size, 0, run_keys)
+
+
+@nb.njit(cache=True)
+def _sift_down(heap, size, i, run_keys):
+    while True:
+        smallest = i
+        for child in (2 * i + 1, 2 * i + 2):
+            if child < size and (run_keys[heap[child]], heap[child]) < (
+                run_keys[heap[smallest]],
+                heap[smallest],
+            ):
+                smallest = child
+        if smallest == i:
+            return
+        heap[i], heap[smallest] = heap[smallest], heap[i]
+        i = smallest
+
+
+def _save_puzzle_keys(path, keys, chunk_size):
+    """Save the distinct keys from a sorted array of keys, and the offset of the first of each,
+    reading the keys `chunk_size` at a time."""
+
+    def first_of_each_key(start):
+        # the indexes in this chunk of keys that differ from the previous key
+        chunk = keys[start : start + chunk_size]
+        is_first = np.empty(len(chunk), dtype=np.bool_)
+        is_first[0] = start == 0 or chunk[0] != keys[start - 1]
+        is_first[1:] = chunk[1:] != chunk[:-1]
+        return np.flatnonzero(is_first) + start
+
+    starts = range(0, len(keys), chunk_size)
+    num_keys = sum(len(first_of_each_key(start)) for start in starts)
+    puzzle_keys = _open_memmap(path / "puzzle_keys.npy", np.uint64, num_keys)
+    puzzle_offsets = _open_memmap(path / "puzzle_offsets.npy", np.int64, num_keys + 1)
+    i = 0
+    for start in starts:
+        offsets = first_of_each_key(start)
+        puzzle_keys[i : i + len(offsets)] = keys[offsets]
+        puzzle_offsets[i : i + len(offsets)] = offsets
+        i += len(offsets)
+    puzzle_offsets[num_keys] = len(keys)
+    puzzle_keys.flush()
+    puzzle_offsets.flush()
+
+
+def _load(num_pieces, names, parallel):
+    path = index_path(num_pieces)
+    if not path.exists():
+        build_index(num_pieces, parallel=parallel)
+    return tuple(np.load(path / f"{name}.npy", mmap_mode="r") for name in names)
+
+
+def load_canonical_boards(num_pieces, parallel=False):
+    """Load all the canonical boards containing `num_pieces` from the index, building it first if needed.
+
+    Returns the canonical puzzle keys followed by the boards and their lights and dominoes,
+    all sorted by key and memory-mapped from disk.
+    """
+    return _load(num_pieces, ARRAY_NAMES, parallel)
+
+
+def load_puzzle_keys(num_pieces, parallel=False):
+    """Load the distinct canonical puzzle keys for boards containing `num_pieces` from the index.
+
+    Returns the sorted keys, and the offsets of the boards for each key in the arrays returned
+    by `load_canonical_boards`. There is one more offset than there are keys, so the boards
+    for key `i` are at indexes `offsets[i]` up to `offsets[i + 1]`.
+    """
+    return _load(num_pieces, PUZZLE_KEY_ARRAY_NAMES, parallel)
+
+
+def lookup(keys, key):
+    """Return the start and end indexes of the entries in the sorted `keys` array that match
+    `key`, which may be an array of keys (in which case arrays of indexes are returned)."""
+    key = np.asarray(key, dtype=np.uint64)
+    start = np.searchsorted(keys, key, side="left")
+    end = np.searchsorted(keys, key, side="right")
+    return start, end
@@ -1,4 +1,5 @@
 import csv
+from collections import Counter
 from pathlib import Path
 from pprint import pprint
 
@@ -7,9 +8,15 @@ from rich.console import Console
 
 from polarize.difficulty import puzzle_features
 from polarize.game import play_game
-from polarize.generate import puzzle_generator, generate as generate_puzzle
+from polarize.generate import REJECTIONS, puzzle_generator, generate as generate_puzzle
+from polarize.index import index_path, load_canonical_boards
 from polarize.solve import solve
-from polarize.storage import load_puzzle, save_puzzle, first_missing_puzzle_path
+from polarize.storage import (
+    archive_index,
+    first_missing_puzzle_path,
+    load_puzzle,
+    save_puzzle,
+)
 
 
 @click.group()
@@ -23,24 +30,45 @@ def cli():
 @click.option("--pieces", default=3)
 @click.option("--max-yellow-spots", default=8)  # unlimited
 @click.option("--min-distinct-dominoes", default=1)
-def generate(filename, number, pieces, max_yellow_spots, min_distinct_dominoes):
+@click.option("--from-tables", is_flag=True)
+@click.option("--seed", type=int, default=None)
+@click.option("--workers", default=1)
+def generate(
+    filename,
+    number,
+    pieces,
+    max_yellow_spots,
+    min_distinct_dominoes,
+    from_tables,
+    seed,
+    workers,
+):
     """Generate puzzles according to specified criteria"""
 
     if filename is not None and number != 1:
         raise ValueError("Can't set `filename` when `number` is not 1")
-    generator = puzzle_generator(4, pieces)
+    # don't generate puzzles that have already been set (in any orientation)
+    archive = archive_index()
+    stats = Counter()
+    generator = puzzle_generator(
+        4,
+        pieces,
+        from_tables=from_tables,
+        seed=seed,
+        workers=workers,
+        max_yellow_spots=max_yellow_spots,
+        min_distinct_dominoes=min_distinct_dominoes,
+        exclude=frozenset(archive),
+        stats=stats,
+    )
+    console = Console()
     for _ in range(number):
-        while True:
+        puzzle, _ = next(generator)
+        while puzzle in archive:  # may have been saved since generation started
+            stats["excluded"] += 1
             puzzle, _ = next(generator)
-            features = puzzle_features(puzzle)
-            if (
-                features["num_yellow_spots"] <= max_yellow_spots
-                and features["num_distinct_dominoes"] >= min_distinct_dominoes
-            ):
-                break
-        console = Console()
         console.print(puzzle)
-        pprint(features)
+        pprint(puzzle_features(puzzle))
 
         if filename:
             f = filename
@@ -48,6 +76,13 @@ def generate(filename, number, pieces, max_yellow_spots, min_distinct_dominoes):
             # save directly as next puzzle
             f = first_missing_puzzle_path()
         save_puzzle(puzzle, f)
+    generator.close()
+
+    if stats:
+        console.print("Rejected while generating:")
+        for name, description in REJECTIONS.items():
+            if stats[name]:
+                console.print(f"  {stats[name]} {description}")
 
 
 @cli.command()
@@ -90,5 +125,15 @@ def features(directory, output):
             writer.writerow(feature)
 
 
+@cli.command()
+@click.option("--pieces", default=4)
+@click.option("--parallel/--no-parallel", default=True)
+def index(pieces, parallel):
+    """Build the on-disk index of canonical boards, for up to the given number of pieces"""
+    for num_pieces in range(pieces + 1):
+        keys = load_canonical_boards(num_pieces, parallel=parallel)[0]
+        print(f"{index_path(num_pieces)}: {len(keys)} boards")
+
+
 if __name__ == "__main__":
     cli()
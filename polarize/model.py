@@ -1,8 +1,8 @@
-from dataclasses import dataclass
 from enum import Enum
 import functools
 from itertools import product
 import json
+from typing import NamedTuple
 
 import numpy as np
 from rich.text import Text
@@ -54,14 +54,52 @@ class Orientation(Enum):
         return NotImplemented
 
 
-@dataclass(frozen=True, order=True)
+@functools.total_ordering
 class Domino:
     """A domino is made up of two polarizing filters, and is oriented either
-    horizontally or vertically."""
+    horizontally or vertically.
+
+    Dominoes are immutable and interned, so there is only ever one instance of each of
+    the 8 dominoes, and they can be compared and hashed cheaply.
+    """
+
+    __slots__ = ("orientation", "filter1", "filter2", "value")
+    _instances = {}
+
+    def __new__(cls, orientation, filter1, filter2):
+        key = (orientation, filter1, filter2)
+        domino = cls._instances.get(key)
+        if domino is None:
+            domino = object.__new__(cls)
+            value = (
+                ((orientation.value - 1) << 2)
+                | ((filter1.value - 1) << 1)
+                | (filter2.value - 1)
+            )
+            for name, val in zip(cls.__slots__, (*key, value)):
+                object.__setattr__(domino, name, val)
+            cls._instances[key] = domino
+        return domino
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"cannot assign to field '{name}'")
+
+    def __reduce__(self):
+        return Domino, (self.orientation, self.filter1, self.filter2)
+
+    def __hash__(self):
+        return self.value
+
+    def __lt__(self, other):
+        if self.__class__ is other.__class__:
+            return self.value < other.value
+        return NotImplemented
 
-    orientation: Orientation
-    filter1: Filter
-    filter2: Filter
+    def __repr__(self):
+        return (
+            f"Domino(orientation={self.orientation!r}, "
+            f"filter1={self.filter1!r}, filter2={self.filter2!r})"
+        )
 
     def places(self, n=4):
         # return y, x values of where this domino can be placed on a board
@@ -82,14 +120,6 @@ class Domino:
         else:
             return Domino(self.orientation, self.filter2.other, self.filter1.other)
 
-    @property
-    def value(self):
-        return (
-            ((self.orientation.value - 1) << 2)
-            | ((self.filter1.value - 1) << 1)
-            | (self.filter2.value - 1)
-        )
-
     def __str__(self):
         if self.orientation == Orientation.H:
             return f"{self.filter1.char}{self.filter2.char}"
@@ -130,10 +160,10 @@ class Puzzle:
             initial_placed_dominoes=[
                 PlacedDomino.from_json_dict(d) for d in data["initial_placed_dominoes"]
             ],
+            # the solution's values are derived from its placed dominoes
             solution=Board(
                 data["n"],
-                np.array(data["solution"]["values"], dtype=np.int8),
-                set(
+                placed_dominoes=set(
                     PlacedDomino.from_json_dict(d)
                     for d in data["solution"]["placed_dominoes"]
                 ),
@@ -197,13 +227,37 @@ class Puzzle:
         return text
 
 
-@dataclass(frozen=True)
 class PlacedDomino:
-    """A domino placed in a fixed position on a board."""
+    """A domino placed in a fixed position on a board.
+
+    Like dominoes, placed dominoes are immutable and interned.
+    """
 
-    domino: Domino
-    x: int  # across
-    y: int  # down
+    __slots__ = ("domino", "x", "y", "_hash")
+    _instances = {}
+
+    def __new__(cls, domino, x, y):
+        key = (domino, x, y)
+        pd = cls._instances.get(key)
+        if pd is None:
+            pd = object.__new__(cls)
+            x, y = int(x), int(y)  # across, down
+            for name, val in zip(cls.__slots__, (domino, x, y, hash(key))):
+                object.__setattr__(pd, name, val)
+            cls._instances[key] = pd
+        return pd
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"cannot assign to field '{name}'")
+
+    def __reduce__(self):
+        return PlacedDomino, (self.domino, self.x, self.y)
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return f"PlacedDomino(domino={self.domino!r}, x={self.x!r}, y={self.y!r})"
 
     @property
     def T(self):
@@ -223,13 +277,218 @@ class PlacedDomino:
         return PlacedDomino(ALL_DOMINOES[data["domino"]], data["i"], data["j"])
 
 
+class Placement(NamedTuple):
+    """The bits set by a domino placed on an n x n board, packed with 2 bits per cell (see `Board`)."""
+
+    mask: int  # 0b11 in each of the two cells covered by the domino
+    filters: int
+    orientations: int
+    # the bitwise or of the filters in each row then each column, packed like encoded lights
+    light_filters: int
+    # the (row or column, filter) counter to increment for each cell (see `Board`), and the
+    # amount the encoded lights change by when that counter changes to or from zero
+    light_updates: tuple
+
+
+@functools.cache
+def placement_table(n):
+    """Return the placements of every domino at every position on an n x n board.
+
+    The table is a dict mapping each placed domino that fits on the board to its `Placement`.
+    It is ordered by domino, then by the position of the domino's first cell (across then down).
+    """
+    table = {}
+    top = 2 * (n * n - 1)
+    for domino in ALL_DOMINOES:
+        for y, x in domino.places(n):
+            if domino.orientation == Orientation.H:
+                x2, y2 = x + 1, y
+            else:
+                x2, y2 = x, y + 1
+            s1 = top - 2 * (y * n + x)
+            s2 = top - 2 * (y2 * n + x2)
+            f1, f2 = domino.filter1.value, domino.filter2.value
+            o = domino.orientation.value
+
+            light_filters = 0
+            light_updates = []
+            for i, f in ((y, f1), (y2, f2), (n + x, f1), (n + x2, f2)):
+                light_filters |= f << 2 * (2 * n - 1 - i)
+                light_updates.append((2 * i + f - 1, 1 << 2 * (2 * n - 1 - i)))
+
+            table[PlacedDomino(domino, x, y)] = Placement(
+                mask=(0b11 << s1) | (0b11 << s2),
+                filters=(f1 << s1) | (f2 << s2),
+                orientations=(o << s1) | (o << s2),
+                light_filters=light_filters,
+                light_updates=tuple(light_updates),
+            )
+    return table
+
+
+@functools.cache
+def placement_planes(n):
+    """Return the bitplanes set by every domino at every position on an n x n board (n <= 8).
+
+    The result is an array indexed by plane (cells with a POS_45 filter, cells with a NEG_45
+    filter, cells covered by a horizontal domino, cells covered by a vertical domino), then by
+    domino value, then by the position of the domino's first cell (`y * n + x`). Each plane is
+    an unsigned 64-bit int with cell (x, y) at bit `y * 8 + x` (see bitboard.py), and is zero
+    for a domino that doesn't fit at a position.
+    """
+    assert n <= 8
+    planes = np.zeros((4, len(ALL_DOMINOES), n * n), dtype=np.uint64)
+    for pd in placement_table(n):
+        domino, x, y = pd.domino, pd.x, pd.y
+        if domino.orientation == Orientation.H:
+            x2, y2 = x + 1, y
+        else:
+            x2, y2 = x, y + 1
+        o = 2 if domino.orientation == Orientation.H else 3
+        pos = y * n + x
+        for cx, cy, f in ((x, y, domino.filter1), (x2, y2, domino.filter2)):
+            bit = np.uint64(1 << (cy * 8 + cx))
+            planes[0 if f == Filter.POS_45 else 1, domino.value, pos] |= bit
+            planes[o, domino.value, pos] |= bit
+    planes.flags.writeable = False
+    return planes
+
+
+# 0b01 in every 2-bit field
+_LOW_BITS = (4**64 - 1) // 3
+
+
+def _swap_bit_pairs(bits):
+    """Swap the two bits in each 2-bit field, which swaps filters (POS_45 and NEG_45)
+    or orientations (H and V), and leaves empty cells unchanged."""
+    return ((bits & _LOW_BITS) << 1) | ((bits >> 1) & _LOW_BITS)
+
+
+def count_lights(light_filters):
+    """Convert packed light filters (see `Placement`) to encoded lights, by counting the bits in each field."""
+    return (light_filters & _LOW_BITS) + ((light_filters >> 1) & _LOW_BITS)
+
+
+def lights_within(lights_val, limit_val, num_lights):
+    """Return True if each of the encoded lights is no more than the corresponding limit."""
+    for shift in range(0, 2 * num_lights, 2):
+        if (lights_val >> shift) & 0b11 > (limit_val >> shift) & 0b11:
+            return False
+    return True
+
+
 class Board:
-    """A Polarize board consists of a set of placed dominoes."""
+    """A Polarize board consists of a set of placed dominoes.
 
-    def __init__(self, n=4, values=None, placed_dominoes=None):
+    The board is stored as two ints, packing the filter value and the orientation of the domino
+    in each cell into 2 bits, with the first cell in the highest bits (the same layout as
+    `encode.encode_board`). The `values` array is derived from them when needed, as is the set
+    of `placed_dominoes` for a board created from bits.
+
+    The lights are maintained incrementally as dominoes are added and removed, by counting the
+    cells with each filter in each row and column, so reading them takes constant time.
+    """
+
+    def __init__(self, n=4, placed_dominoes=None):
         self.n = n
-        self.values = values if values is not None else np.zeros((n, n), dtype=np.int8)
-        self.placed_dominoes = placed_dominoes if placed_dominoes is not None else set()
+        self._filters = 0
+        self._orientations = 0
+        self._filter_counts = [0] * (4 * n)  # for each row then column, for each filter
+        self._lights = 0
+        self._placed_dominoes = set()
+        self._clear_cache()
+        self._placements = placement_table(n)
+        for pd in placed_dominoes or ():
+            self.add_domino(pd)
+
+    @classmethod
+    def from_bits(cls, n, filters, orientations):
+        """Create a board from packed filter and orientation bits (see `filter_bits` and `orientation_bits`)."""
+        board = cls(n)
+        board._filters = int(filters)
+        board._orientations = int(orientations)
+        # these are derived from the bits when first needed
+        board._filter_counts = None
+        board._placed_dominoes = None
+        return board
+
+    def _clear_cache(self):
+        self._values = None
+        self._paths_horizontal = None
+        self._paths_vertical = None
+
+    def __getstate__(self):
+        # the placement table is shared by all boards of the same size, so don't pickle it
+        state = self.__dict__.copy()
+        del state["_placements"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._placements = placement_table(self.n)
+
+    def _count_filters(self):
+        n = self.n
+        counts = [0] * (4 * n)
+        shift = 2 * (n * n - 1)
+        for y in range(n):
+            for x in range(n):
+                f = (self._filters >> shift) & 0b11
+                if f:
+                    counts[2 * y + f - 1] += 1
+                    counts[2 * (n + x) + f - 1] += 1
+                shift -= 2
+        lights = 0
+        for i in range(2 * n):
+            lights = (lights << 2) | (counts[2 * i] > 0) + (counts[2 * i + 1] > 0)
+        self._filter_counts = counts
+        self._lights = lights
+
+    @property
+    def filter_bits(self):
+        """The filter value in each cell, packed into an int with 2 bits per cell."""
+        return self._filters
+
+    @property
+    def orientation_bits(self):
+        """The orientation of the domino in each cell, packed into an int with 2 bits per cell."""
+        return self._orientations
+
+    def _unpack(self, bits):
+        n = self.n
+        arr = np.zeros(n * n, dtype=np.int8)
+        shift = 2 * (n * n - 1)
+        for i in range(n * n):
+            arr[i] = bits >> shift & 0b11
+            shift -= 2
+        return arr.reshape(n, n)
+
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = self._unpack(self._filters)
+            self._values.flags.writeable = False
+        return self._values
+
+    @property
+    def placed_dominoes(self):
+        if self._placed_dominoes is None:
+            # scan the cells in order, so the first cell of each domino is found first
+            n = self.n
+            filters = self.values
+            orientations = self._unpack(self._orientations)
+            scanned = np.zeros((n, n), dtype=np.bool_)
+            placed_dominoes = set()
+            for y, x in zip(*np.nonzero(orientations)):
+                if scanned[y, x]:
+                    continue
+                orient = Orientation(orientations[y, x])
+                y2, x2 = (y, x + 1) if orient == Orientation.H else (y + 1, x)
+                domino = Domino(orient, Filter(filters[y, x]), Filter(filters[y2, x2]))
+                placed_dominoes.add(PlacedDomino(domino, int(x), int(y)))
+                scanned[y2, x2] = True
+            self._placed_dominoes = placed_dominoes
+        return self._placed_dominoes
 
     @property
     def colours(self):
@@ -240,38 +499,45 @@ class Board:
 
     @property
     def orientations(self):
-        orient = np.zeros((self.n, self.n), dtype=np.int8)
-        for pd in self.placed_dominoes:
-            orient[pd.np_index] = pd.domino.orientation.value
-        return orient
+        return self._unpack(self._orientations)
 
     def can_add(self, placed_domino):
-        try:
-            return np.all(self.values[placed_domino.np_index] == 0)
-        except IndexError:
-            return False
+        placement = self._placements.get(placed_domino)
+        return placement is not None and self._filters & placement.mask == 0
 
     def add_domino(self, placed_domino):
-        domino = placed_domino.domino
-        self.values[placed_domino.np_index] = [
-            domino.filter1.value,
-            domino.filter2.value,
-        ]
-        self.placed_dominoes.add(placed_domino)
+        placement = self._placements[placed_domino]
+        if self._filter_counts is None:
+            self._count_filters()
+        self._filters |= placement.filters
+        self._orientations |= placement.orientations
+        counts = self._filter_counts
+        for i, light in placement.light_updates:
+            if counts[i] == 0:
+                self._lights += light
+            counts[i] += 1
+        if self._placed_dominoes is not None:
+            self._placed_dominoes.add(placed_domino)
+        self._clear_cache()
 
     def can_remove(self, placed_domino):
-        domino = placed_domino.domino
-        try:
-            return np.all(
-                self.values[placed_domino.np_index]
-                == [domino.filter1.value, domino.filter2.value]
-            )
-        except IndexError:
-            return False
+        return placed_domino in self.placed_dominoes
 
     def remove_domino(self, placed_domino):
-        self.values[placed_domino.np_index] = 0
-        self.placed_dominoes.remove(placed_domino)
+        if not self.can_remove(placed_domino):
+            raise KeyError(placed_domino)
+        placement = self._placements[placed_domino]
+        if self._filter_counts is None:
+            self._count_filters()
+        self._filters &= ~placement.mask
+        self._orientations &= ~placement.mask
+        counts = self._filter_counts
+        for i, light in placement.light_updates:
+            counts[i] -= 1
+            if counts[i] == 0:
+                self._lights -= light
+        self._placed_dominoes.remove(placed_domino)
+        self._clear_cache()
 
     def on_board(self, x, y):
         """Return True if x, y is on the inner board (not outer edge or corners)"""
@@ -279,33 +545,42 @@ class Board:
 
     @property
     def lights(self):
+        lights_int = self.lights_int
         li = np.empty(self.n * 2, dtype=np.uint8)
-        lo = np.bitwise_count(np.bitwise_or.reduce(self.values, axis=0))
-        hi = np.bitwise_count(np.bitwise_or.reduce(self.values, axis=1))
-        li[: self.n] = hi
-        li[self.n :] = lo
+        shift = 2 * (self.n * 2 - 1)
+        for i in range(self.n * 2):
+            li[i] = lights_int >> shift & 0b11
+            shift -= 2
         return li
 
     @property
     def lights_int(self):
         """Return an int encoding the lights, determined by the dominoes placed on this board."""
-        return encode_lights(self.lights)
+        if self._filter_counts is None:
+            self._count_filters()
+        return self._lights
 
     @property
     def paths_horizontal(self):
-        paths = np.zeros((self.n, self.n + 1), dtype=np.uint8)
-        for i in range(self.n):
-            paths[:, i + 1] = np.bitwise_or(paths[:, i], self.values[:, i])
-        paths = np.bitwise_count(paths)
-        return paths
+        if self._paths_horizontal is None:
+            paths = np.zeros((self.n, self.n + 1), dtype=np.uint8)
+            for i in range(self.n):
+                paths[:, i + 1] = np.bitwise_or(paths[:, i], self.values[:, i])
+            paths = np.bitwise_count(paths)
+            paths.flags.writeable = False
+            self._paths_horizontal = paths
+        return self._paths_horizontal
 
     @property
     def paths_vertical(self):
-        paths = np.zeros((self.n + 1, self.n), dtype=np.uint8)
-        for i in range(self.n):
-            paths[i + 1, :] = np.bitwise_or(paths[i, :], self.values[i, :])
-        paths = np.bitwise_count(paths)
-        return paths
+        if self._paths_vertical is None:
+            paths = np.zeros((self.n + 1, self.n), dtype=np.uint8)
+            for i in range(self.n):
+                paths[i + 1, :] = np.bitwise_or(paths[i, :], self.values[i, :])
+            paths = np.bitwise_count(paths)
+            paths.flags.writeable = False
+            self._paths_vertical = paths
+        return self._paths_vertical
 
     def rot90(self):
         """Rotate the board through 90 degrees"""
@@ -322,37 +597,48 @@ class Board:
     def reflect_vertically(self):
         """Reflect the board vertically"""
 
-        def reflect_val(val):
-            if val == Filter.POS_45.value:
-                return Filter.NEG_45.value
-            elif val == Filter.NEG_45.value:
-                return Filter.POS_45.value
-            else:
-                return val
-
-        def reflect_pd(pd):
-            d = pd.domino
-            if d.orientation == Orientation.H:
-                return PlacedDomino(d.reflect_vertically, pd.x, self.n - 1 - pd.y)
-            else:
-                return PlacedDomino(d.reflect_vertically, pd.x, self.n - 2 - pd.y)
-
-        n = self.n  # size doesn't change
-        values = np.flip(self.values, axis=0)
-        values = np.vectorize(reflect_val)(values)
-        placed_dominoes = set(reflect_pd(pd) for pd in self.placed_dominoes)
-        return Board(n, values=values, placed_dominoes=placed_dominoes)
+        # reverse the order of the rows, and swap the filters (POS_45 and NEG_45)
+        n = self.n
+        row_bits = 2 * n
+        row_mask = (1 << row_bits) - 1
+        filters = orientations = 0
+        for y in range(n):
+            shift = row_bits * (n - 1 - y)
+            reflected_shift = row_bits * y
+            filters |= ((self._filters >> shift) & row_mask) << reflected_shift
+            orientations |= (
+                (self._orientations >> shift) & row_mask
+            ) << reflected_shift
+        return Board.from_bits(n, _swap_bit_pairs(filters), orientations)
 
     def transpose(self):
         """Reflect the board in y=x"""
 
-        n = self.n  # size doesn't change
-        values = self.values.copy().T  # values don't change
-        placed_dominoes = set(pd.T for pd in self.placed_dominoes)
-        return Board(n, values=values, placed_dominoes=placed_dominoes)
+        # move each cell, and swap the orientations (H and V)
+        n = self.n
+        top = 2 * (n * n - 1)
+        filters = orientations = 0
+        for y in range(n):
+            for x in range(n):
+                shift = top - 2 * (y * n + x)
+                transposed_shift = top - 2 * (x * n + y)
+                filters |= ((self._filters >> shift) & 0b11) << transposed_shift
+                orientations |= (
+                    (self._orientations >> shift) & 0b11
+                ) << transposed_shift
+        return Board.from_bits(n, filters, _swap_bit_pairs(orientations))
 
     def transforms(self):
         """Return all the transforms of this board."""
+        if self.n == 4:
+            # use the bit-level kernels, which compute all the transforms in one call
+            from polarize.encode import encode_board, transforms
+
+            for val in transforms(encode_board(self)):
+                val = int(val)
+                yield Board.from_bits(4, val >> 32, val & 0xFFFFFFFF)
+            return
+
         board = self
         yield board
         board = board.rot90()
@@ -385,13 +671,13 @@ class Board:
         if isinstance(other, Board):
             return (
                 self.n == other.n
-                and np.array_equal(self.values, other.values)
-                and self.placed_dominoes == other.placed_dominoes
+                and self._filters == other._filters
+                and self._orientations == other._orientations
             )
         return False
-    
+
     def __hash__(self):
-        return hash((self.n, self.values.tobytes(), frozenset(self.placed_dominoes)))
+        return hash((self.n, self._filters, self._orientations))
 
     def __str__(self):
         return str(self.values)
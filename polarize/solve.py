@@ -1,115 +1,205 @@
 from functools import cache
-from itertools import chain, combinations
 
 import numpy as np
 
-from polarize.encode import decode_board, encode_dominoes, all_puzzles
-from polarize.generate import all_boards_with_dominoes
-
-
-# from https://docs.python.org/3/library/itertools.html#itertools-recipes
-def powerset(iterable):
-    s = list(iterable)
-    return chain.from_iterable(combinations(s, r) for r in range(len(s) + 1))
+from polarize import bitboard
+from polarize.encode import (
+    canonicalize_puzzles,
+    decode_board,
+    encode_puzzle_keys,
+    encode_puzzles,
+    lights_key_range,
+    num_dominoes,
+    solutions_from_canonical_boards,
+    sub_puzzles_from_canonical_keys,
+)
+from polarize.index import load_canonical_boards, load_puzzle_keys, lookup
 
 
 def solve(puzzle, *, fewer_pieces_allowed=False):
-    solution_boards = []
+    """Find all the solutions to a puzzle by searching for them (see `bitboard.search`).
 
-    def sort_tuple(t):
-        return tuple(sorted(t))
+    If `fewer_pieces_allowed` is True then boards that use any sub-multiset of the dominoes
+    (including none of them) are solutions too.
+    """
+    solutions = bitboard.solve_puzzle(puzzle, fewer_pieces_allowed=fewer_pieces_allowed)
+    return [bitboard.decode_bitboard(puzzle.n, planes) for planes in solutions]
 
-    if fewer_pieces_allowed:
-        dominoes_subsets = set(sort_tuple(s) for s in powerset(puzzle.dominoes))
-    else:
-        dominoes_subsets = [puzzle.dominoes]
 
-    for dominoes_subset in dominoes_subsets:
-        for board in all_boards_with_dominoes(puzzle.n, dominoes_subset):
-            if board.lights_int == puzzle.lights_int:
-                solution_boards.append(board)
+def count_solutions(puzzle, limit=2, *, fewer_pieces_allowed=False):
+    """Return the number of solutions to a puzzle.
 
-    return solution_boards
+    The search stops as soon as `limit` solutions have been found (so the count is at
+    most `limit`), unless `limit` is None.
+    """
+    solutions = bitboard.solve_puzzle(
+        puzzle, fewer_pieces_allowed=fewer_pieces_allowed, limit=limit
+    )
+    return len(solutions)
 
 
 def has_unique_solution(puzzle, *, fewer_pieces_allowed=False):
-    solutions = solve(puzzle, fewer_pieces_allowed=fewer_pieces_allowed)
-    return len(solutions) == 1
+    return count_solutions(puzzle, fewer_pieces_allowed=fewer_pieces_allowed) == 1
 
 
 # The "quick" solve functions use the code from encode.py which pre-compute all boards
-# of a certain size
+# of a certain size. The tables are loaded from the on-disk index (see index.py), which only
+# stores canonical boards, sorted by canonical puzzle key. A puzzle is solved by canonicalizing
+# it, looking up its candidate canonical boards with a binary search, and then mapping them back
+# through their transforms. Many puzzles can be solved in a single vectorized pass.
+# When fewer pieces are allowed, the distinct canonical puzzles with the same canonical lights in
+# each smaller table are checked for a sub-multiset of the puzzle's dominoes first, so only the
+# boards for the matching puzzles are ever looked at.
+# The tables only exist for 4x4 boards, so puzzles on other sizes of board are solved with the
+# search instead.
 
 
 @cache
-def _get_all_puzzles(num_pieces, fewer_pieces_allowed=False):
-    if not fewer_pieces_allowed:
-        return all_puzzles(num_pieces)
-
-    # concat all arrays for all puzzles up to num_pieces
-    all_boards_list = []
-    all_lights_list = []
-    all_dominoes_list = []
-    for n in range(num_pieces + 1):
-        _, all_boards, all_lights, all_dominoes = all_puzzles(n)
-        all_boards_list.append(all_boards)
-        all_lights_list.append(all_lights)
-        all_dominoes_list.append(all_dominoes)
+def _get_canonical_boards(num_pieces):
+    return load_canonical_boards(num_pieces)
 
-    all_boards = np.concatenate(all_boards_list)
-    all_lights = np.concatenate(all_lights_list)
-    all_dominoes = np.concatenate(all_dominoes_list)
-
-    return None, all_boards, all_lights, all_dominoes
 
+@cache
+def _get_puzzle_keys(num_pieces):
+    return load_puzzle_keys(num_pieces)
 
-def _boards_and_lights_for_dominoes(puzzle, *, fewer_pieces_allowed=False):
-    num_pieces = len(puzzle.dominoes)
 
-    _, all_boards, all_lights, all_dominoes = _get_all_puzzles(
-        num_pieces, fewer_pieces_allowed=fewer_pieces_allowed
+def _candidate_ranges(lights_vals, dominoes_vals, fewer_pieces_allowed):
+    """Yield the indexes of some of the puzzles (which may be repeated), the range of candidate
+    canonical boards for each of them, and the boards and dominoes of the table they are in.
+    """
+    canonical_lights, canonical_dominoes = canonicalize_puzzles(
+        lights_vals, dominoes_vals
     )
-
+    num_pieces = num_dominoes(dominoes_vals)
     if not fewer_pieces_allowed:
-        # simple case: use exactly num_pieces
-        dominoes_val = encode_dominoes(
-            np.array([d.value for d in puzzle.dominoes], dtype=np.int8)
+        # the candidates have the same canonical puzzle key, in the table with as many pieces
+        keys = encode_puzzle_keys(canonical_lights, canonical_dominoes)
+        for k in np.unique(num_pieces):
+            sel = np.flatnonzero(num_pieces == k)
+            table_keys, table_boards, _, table_dominoes = _get_canonical_boards(int(k))
+            starts, ends = lookup(table_keys, keys[sel])
+            yield sel, starts, ends, table_boards, table_dominoes
+        return
+
+    # the candidates are the boards of the canonical puzzles with the same lights and a
+    # sub-multiset of the dominoes, in each table with as many pieces or fewer
+    start_keys, end_keys = lights_key_range(canonical_lights)
+    for k in range(int(np.max(num_pieces, initial=0)) + 1):
+        sel = np.flatnonzero(num_pieces >= k)
+        puzzle_keys, puzzle_offsets = _get_puzzle_keys(k)
+        _, table_boards, _, table_dominoes = _get_canonical_boards(k)
+        num_matches, matches = sub_puzzles_from_canonical_keys(
+            np.searchsorted(puzzle_keys, start_keys[sel]),
+            np.searchsorted(puzzle_keys, end_keys[sel]),
+            puzzle_keys,
+            lights_vals[sel],
+            dominoes_vals[sel],
         )
-        dominoes_index = all_dominoes == dominoes_val
-
-    else:
-        # use num_pieces or fewer
-        dominoes_subsets = set(powerset([d.value for d in puzzle.dominoes]))
-        dominoes_vals = np.empty(len(dominoes_subsets), dtype=np.uint32)
-        for i, dominoes_subset in enumerate(dominoes_subsets):
-            dominoes_ints_subset = np.array(list(dominoes_subset), dtype=np.int8)
-            dominoes_vals[i] = encode_dominoes(dominoes_ints_subset)
-        dominoes_index = np.isin(all_dominoes, dominoes_vals)
+        starts, ends = puzzle_offsets[matches], puzzle_offsets[matches + 1]
+        yield np.repeat(sel, num_matches), starts, ends, table_boards, table_dominoes
+
+
+def quick_solve_many(lights_vals, dominoes_vals, *, fewer_pieces_allowed=False):
+    """Solve many puzzles at once, given as arrays of encoded lights and dominoes.
+
+    Returns an array of the number of solutions for each puzzle, and an array of the
+    encoded solution boards for all the puzzles, concatenated in puzzle order.
+    """
+    lights_vals = np.asarray(lights_vals, dtype=np.uint32)
+    dominoes_vals = np.asarray(dominoes_vals, dtype=np.uint32)
+
+    # find the transforms of the candidate boards that solve each puzzle
+    puzzle_index = [np.empty(0, dtype=np.int64)]
+    solutions = [np.empty(0, dtype=np.uint64)]
+    for sel, starts, ends, table_boards, table_dominoes in _candidate_ranges(
+        lights_vals, dominoes_vals, fewer_pieces_allowed
+    ):
+        sel_counts, sel_solutions = solutions_from_canonical_boards(
+            starts,
+            ends,
+            table_boards,
+            table_dominoes,
+            lights_vals[sel],
+            dominoes_vals[sel],
+            fewer_pieces_allowed,
+        )
+        puzzle_index.append(np.repeat(sel, sel_counts))
+        solutions.append(sel_solutions)
+
+    # gather the solutions, in the same order as the puzzles
+    puzzle_index = np.concatenate(puzzle_index)
+    boards = np.concatenate(solutions)
+    counts = np.bincount(puzzle_index, minlength=len(lights_vals))
+    return counts, boards[np.argsort(puzzle_index, kind="stable")]
+
+
+def quick_count_solutions_many(
+    lights_vals, dominoes_vals, limit=2, *, fewer_pieces_allowed=False
+):
+    """Count the solutions to many puzzles at once, given as arrays of encoded lights and dominoes.
+
+    The search for each puzzle stops as soon as `limit` solutions have been found (so the
+    counts are at most `limit`), unless `limit` is None. Solutions are never decoded.
+    """
+    lights_vals = np.asarray(lights_vals, dtype=np.uint32)
+    dominoes_vals = np.asarray(dominoes_vals, dtype=np.uint32)
+    if limit is None:
+        counts, _ = quick_solve_many(
+            lights_vals, dominoes_vals, fewer_pieces_allowed=fewer_pieces_allowed
+        )
+        return counts
+
+    counts = np.zeros(len(lights_vals), dtype=np.int64)
+    for sel, starts, ends, table_boards, table_dominoes in _candidate_ranges(
+        lights_vals, dominoes_vals, fewer_pieces_allowed
+    ):
+        sel_counts, _ = solutions_from_canonical_boards(
+            starts,
+            ends,
+            table_boards,
+            table_dominoes,
+            lights_vals[sel],
+            dominoes_vals[sel],
+            fewer_pieces_allowed,
+            limit,
+            False,
+        )
+        np.add.at(counts, sel, sel_counts)
+    return np.minimum(counts, limit)
 
-    # restrict to boards and lights with desired dominoes
-    boards_with_pieces = all_boards[dominoes_index]
-    lights_with_dominoes = all_lights[dominoes_index]
 
-    return boards_with_pieces, lights_with_dominoes
+def quick_has_unique_solution_many(
+    lights_vals, dominoes_vals, *, fewer_pieces_allowed=False
+):
+    """Return a boolean array indicating which puzzles have a unique solution."""
+    counts = quick_count_solutions_many(
+        lights_vals, dominoes_vals, fewer_pieces_allowed=fewer_pieces_allowed
+    )
+    return counts == 1
 
 
-def _quick_solve(puzzle, *, fewer_pieces_allowed=False):
-    # restrict to boards and lights with desired dominoes
-    boards_with_dominoes, lights_with_dominoes = _boards_and_lights_for_dominoes(
-        puzzle, fewer_pieces_allowed=fewer_pieces_allowed
+def quick_solve(puzzle, *, fewer_pieces_allowed=False):
+    if puzzle.n != 4:
+        return solve(puzzle, fewer_pieces_allowed=fewer_pieces_allowed)
+    _, matching_boards = quick_solve_many(
+        *encode_puzzles([puzzle]), fewer_pieces_allowed=fewer_pieces_allowed
     )
+    return [decode_board(b) for b in matching_boards]
 
-    # restrict to lights in puzzle
-    lights_val = puzzle.lights_int
-    matching_boards = boards_with_dominoes[lights_with_dominoes == lights_val]
-
-    return matching_boards
 
+def quick_count_solutions(puzzle, limit=2, *, fewer_pieces_allowed=False):
+    """Return the number of solutions to a puzzle, using the precomputed tables.
 
-def quick_solve(puzzle, *, fewer_pieces_allowed=False):
-    matching_boards = _quick_solve(puzzle, fewer_pieces_allowed=fewer_pieces_allowed)
-    return [decode_board(b) for b in matching_boards]
+    See `count_solutions`.
+    """
+    if puzzle.n != 4:
+        return count_solutions(puzzle, limit, fewer_pieces_allowed=fewer_pieces_allowed)
+    counts = quick_count_solutions_many(
+        *encode_puzzles([puzzle]), limit, fewer_pieces_allowed=fewer_pieces_allowed
+    )
+    return int(counts[0])
 
 
 def quick_has_unique_solution(puzzle, *, fewer_pieces_allowed=False):
-    return len(quick_solve(puzzle, fewer_pieces_allowed=fewer_pieces_allowed)) == 1
+    return quick_count_solutions(puzzle, fewer_pieces_allowed=fewer_pieces_allowed) == 1
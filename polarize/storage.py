@@ -1,9 +1,20 @@
 import datetime
+import hashlib
 import json
+import os
+from collections import Counter
+from functools import cache
 from pathlib import Path
 
+from polarize import bitboard, encode, model
+from polarize.bitboard import canonicalize_puzzle
+from polarize.encode import encode_puzzles
+from polarize.index import cache_dir, source_version
 from polarize.model import Puzzle
 
+# Bump this whenever the layout of the archive index file changes
+ARCHIVE_INDEX_FORMAT_VERSION = 1
+
 
 def load_puzzle(filename):
     with open(filename) as f:
@@ -13,6 +24,7 @@ def load_puzzle(filename):
 def save_puzzle(puzzle, filename):
     with open(filename, "w") as f:
         json.dump(puzzle.to_json_dict(), f)
+    update_archive_index(puzzle, filename)
 
 
 def first_missing_puzzle_path(puzzles_dir="puzzles"):
@@ -26,3 +38,133 @@ def first_missing_puzzle_path(puzzles_dir="puzzles"):
             return full_board_file
         num_days += 1
         day = day + datetime.timedelta(days=1)
+
+
+def canonical_puzzle_key(puzzle):
+    """Return a key for a puzzle that is the same for all of its rotations and reflections.
+
+    The key is the board size and the canonical puzzle (see `bitboard.canonicalize_puzzle`),
+    with the lights and dominoes packed into a single int.
+    """
+    lights, dominoes = encode_puzzles([puzzle])
+    canonical_lights, canonical_dominoes = canonicalize_puzzle(
+        lights[0], dominoes[0], puzzle.n
+    )
+    return puzzle.n, int(canonical_lights) << 32 | int(canonical_dominoes)
+
+
+class ArchiveIndex:
+    """A persistent index of the canonical keys of the puzzles in an archive directory.
+
+    This is used to avoid generating puzzles that are the same as, or a rotation or reflection
+    of, a puzzle that has already been set. Checking whether a puzzle (or key) is in the index
+    is a set lookup.
+
+    The index is saved in the cache directory (see `index.cache_dir`), along with the
+    modification time of each puzzle file. When it is loaded, only the puzzle files that have
+    been added or changed since it was saved are read, and `save_puzzle` updates it as each
+    new puzzle is written.
+    """
+
+    def __init__(self, puzzles_dir="puzzles"):
+        self.puzzles_dir = Path(puzzles_dir)
+        self.path = archive_index_path(puzzles_dir)
+        self._files = {}  # filename -> (mtime, n, key)
+        self._keys = Counter()
+        if self.path.exists():
+            with open(self.path) as f:
+                for filename, (mtime, n, key) in json.load(f).items():
+                    self._set(filename, mtime, (n, key))
+        self.refresh()
+
+    def __contains__(self, puzzle_or_key):
+        if isinstance(puzzle_or_key, Puzzle):
+            puzzle_or_key = canonical_puzzle_key(puzzle_or_key)
+        return puzzle_or_key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def refresh(self):
+        """Bring the index up to date with the puzzle files in the directory, and save it if
+        anything changed."""
+        changed = False
+        filenames = set()
+        for path in self.puzzles_dir.glob("puzzle-*.json"):
+            filenames.add(path.name)
+            mtime = path.stat().st_mtime_ns
+            if self._files.get(path.name, (None,))[0] != mtime:
+                self._set(path.name, mtime, canonical_puzzle_key(load_puzzle(path)))
+                changed = True
+        for filename in set(self._files) - filenames:
+            self._remove(filename)
+            changed = True
+        if changed:
+            self.save()
+
+    def add(self, puzzle, filename):
+        """Add a puzzle that has been saved in the directory to the index, and save it."""
+        path = Path(filename)
+        self._set(path.name, path.stat().st_mtime_ns, canonical_puzzle_key(puzzle))
+        self.save()
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            filename: [mtime, n, key]
+            for filename, (mtime, n, key) in self._files.items()
+        }
+        # write to a temporary file then rename, so that readers never see a partial index
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def _set(self, filename, mtime, key):
+        if filename in self._files:
+            self._remove(filename)
+        self._files[filename] = (mtime, *key)
+        self._keys[key] += 1
+
+    def _remove(self, filename):
+        _, n, key = self._files.pop(filename)
+        self._keys[(n, key)] -= 1
+        if self._keys[(n, key)] == 0:
+            del self._keys[(n, key)]
+
+
+@cache
+def archive_index_version():
+    """Return a version string that changes whenever the keys in an archive index change.
+
+    The keys are computed by bitboard.py from puzzles encoded by encode.py and model.py, so
+    this is a hash of the source code of all three modules.
+    """
+    return source_version(ARCHIVE_INDEX_FORMAT_VERSION, bitboard, encode, model)
+
+
+def archive_index_path(puzzles_dir="puzzles"):
+    """Return the path of the archive index for a directory of puzzles."""
+    h = hashlib.sha256(str(Path(puzzles_dir).resolve()).encode()).hexdigest()[:16]
+    return cache_dir() / "archives" / archive_index_version() / f"{h}.json"
+
+
+@cache
+def _archive_index(puzzles_dir):
+    return ArchiveIndex(puzzles_dir)
+
+
+def archive_index(puzzles_dir="puzzles"):
+    """Return the archive index for a directory of puzzles, loading it (and bringing it up to
+    date) the first time it is used."""
+    return _archive_index(Path(puzzles_dir).resolve())
+
+
+def update_archive_index(puzzle, filename):
+    """Add a newly saved puzzle to the archive index for its directory, if there is one."""
+    path = Path(filename)
+    if path.name.startswith("puzzle-") and archive_index_path(path.parent).exists():
+        archive_index(path.parent).add(puzzle, filename)
@@ -0,0 +1,109 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from polarize.bitboard import (
+    canonicalize_board,
+    canonicalize_puzzle,
+    decode_bitboard,
+    encode_bitboard,
+    lights_from_planes,
+    solve_puzzle,
+    transforms,
+    transforms_lights,
+)
+from polarize.encode import canonicalize_puzzles, encode_puzzles
+from polarize.model import ALL_DOMINOES, Board, PlacedDomino
+from polarize.solve import quick_count_solutions, quick_solve, solve
+
+
+def make_board(n, placed):
+    board = Board(n=n)
+    for d, x, y in placed:
+        board.add_domino(PlacedDomino(ALL_DOMINOES[d], x, y))
+    return board
+
+
+BOARDS = [
+    make_board(3, ((1, 0, 0), (6, 2, 1))),
+    make_board(4, ((7, 0, 0), (4, 1, 0), (0, 2, 1), (1, 2, 0))),
+    make_board(5, ((0, 0, 0), (7, 4, 0), (2, 2, 2), (5, 1, 3), (3, 3, 4))),
+    make_board(6, ((1, 0, 0), (6, 5, 1), (5, 1, 4), (2, 3, 2))),
+    make_board(8, ((3, 6, 0), (4, 7, 6), (1, 0, 7), (6, 2, 3))),
+]
+
+
+@pytest.mark.parametrize("board", BOARDS, ids=lambda b: f"n={b.n}")
+def test_encode_decode_bitboard(board):
+    planes = encode_bitboard(board)
+    assert decode_bitboard(board.n, planes) == board
+    assert lights_from_planes(planes, board.n) == board.lights_int
+
+
+@pytest.mark.parametrize("board", BOARDS, ids=lambda b: f"n={b.n}")
+def test_transforms(board):
+    n = board.n
+    expected = list(board.transforms())
+    transformed = transforms(encode_bitboard(board), n)
+    assert [decode_bitboard(n, planes) for planes in transformed] == expected
+    assert list(transforms_lights(np.uint32(board.lights_int), n)) == [
+        b.lights_int for b in expected
+    ]
+
+    canonical = canonicalize_board(encode_bitboard(board), n)
+    for b in expected:
+        assert np.array_equal(canonicalize_board(encode_bitboard(b), n), canonical)
+
+
+def test_canonicalize_puzzle():
+    board = BOARDS[1]
+    lights, dominoes = encode_puzzles([board.to_puzzle()])
+    expected = canonicalize_puzzles(lights, dominoes)
+    assert canonicalize_puzzle(lights[0], dominoes[0], 4) == (
+        expected[0][0],
+        expected[1][0],
+    )
+
+
+@pytest.mark.parametrize("n", [3, 4, 5])
+def test_solve_puzzle(n):
+    board = make_board(n, ((0, 0, 0), (5, 1, 1), (6, n - 1, 0)))
+    puzzle = board.to_puzzle()
+    for fewer_pieces_allowed in (False, True):
+        solutions = [
+            decode_bitboard(n, planes)
+            for planes in solve_puzzle(
+                puzzle, fewer_pieces_allowed=fewer_pieces_allowed
+            )
+        ]
+        assert board in solutions
+        assert len(set(solutions)) == len(solutions)
+        for solution in solutions:
+            assert solution.lights_int == puzzle.lights_int
+            dominoes = Counter(pd.domino for pd in solution.placed_dominoes)
+            if fewer_pieces_allowed:
+                assert dominoes <= Counter(puzzle.dominoes)
+            else:
+                assert dominoes == Counter(puzzle.dominoes)
+
+        limited = solve_puzzle(
+            puzzle, fewer_pieces_allowed=fewer_pieces_allowed, limit=1
+        )
+        assert len(limited) == 1
+
+    # the search agrees with the precomputed tables
+    if n == 4:
+        for fewer_pieces_allowed in (False, True):
+            assert set(solve(puzzle, fewer_pieces_allowed=fewer_pieces_allowed)) == set(
+                quick_solve(puzzle, fewer_pieces_allowed=fewer_pieces_allowed)
+            )
+
+
+def test_quick_solve_larger_board():
+    board = BOARDS[2]
+    puzzle = board.to_puzzle()
+    solutions = quick_solve(puzzle)
+    assert board in solutions
+    assert quick_count_solutions(puzzle, None) == len(solutions)
+    assert quick_count_solutions(puzzle) == min(2, len(solutions))
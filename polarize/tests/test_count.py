@@ -1,8 +1,26 @@
-from polarize.count import count_puzzles
+import pytest
+
+from polarize.count import count_puzzles, puzzle_counts
+from polarize.encode import canonical_puzzles_with_unique_solution
 
 
 def test_count_puzzles():
     assert count_puzzles(4, 1) == 96
     assert count_puzzles(4, 2) == 1824
-    # assert count_puzzles(4, 3) == 12816
-    # assert count_puzzles(4, 4) == 25240
+    assert count_puzzles(4, 3) == 12816
+    assert count_puzzles(4, 4) == 25240
+
+
+@pytest.mark.parametrize("num_pieces", [1, 2, 3])
+def test_puzzle_counts(num_pieces):
+    counts = puzzle_counts(4, num_pieces)
+    assert counts.raw == count_puzzles(4, num_pieces)
+    canonical_lights, _ = canonical_puzzles_with_unique_solution(num_pieces)
+    assert counts.distinct == len(canonical_lights)
+
+
+def test_puzzle_counts_other_sizes():
+    assert puzzle_counts(4, 0) == (1, 1)  # the empty board
+    assert puzzle_counts(3, 1) == (48, 6)
+    assert puzzle_counts(5, 1) == (160, 20)
+    assert puzzle_counts(5, 2).raw == 5448
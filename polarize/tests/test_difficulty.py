@@ -1,5 +1,12 @@
-from polarize.model import Puzzle
-from polarize.difficulty import num_candidate_boards, num_valid_domino_places, puzzle_features
+from polarize.encode import encode_puzzles
+from polarize.model import ALL_DOMINOES, Board, PlacedDomino, Puzzle
+from polarize.difficulty import (
+    encoded_puzzle_features,
+    num_candidate_boards,
+    num_valid_domino_places,
+    puzzle_features,
+    valid_domino_places,
+)
 
 
 def test_puzzle_features():
@@ -32,4 +39,20 @@ def test_num_candidate_boards():
     puzzle = Puzzle.from_json_str(
         """{"n": 4, "lights": [2, 1, 1, 0, 2, 1, 1, 1], "dominoes": [2, 4, 2], "initial_placed_dominoes": [{"domino": 2, "i": 1, "j": 0}, {"domino": 2, "i": 1, "j": 1}, {"domino": 4, "i": 0, "j": 0}], "solution": {"values": [[2, 1, 2, 1], [1, 0, 0, 0], [1, 0, 0, 0], [0, 0, 0, 0]], "placed_dominoes": [{"domino": 2, "i": 2, "j": 0}, {"domino": 4, "i": 0, "j": 1}, {"domino": 2, "i": 0, "j": 0}]}}"""
     )
-    assert num_candidate_boards(puzzle) == 4
\ No newline at end of file
+    assert num_candidate_boards(puzzle) == 4
+
+
+def test_num_valid_domino_places_larger_board():
+    board = Board(n=5)
+    for d, x, y in ((0, 0, 0), (7, 4, 0), (2, 2, 2)):
+        board.add_domino(PlacedDomino(ALL_DOMINOES[d], x, y))
+    puzzle = board.to_puzzle()
+
+    for domino in ALL_DOMINOES:
+        expected = len(list(valid_domino_places(puzzle, domino)))
+        assert num_valid_domino_places(puzzle, domino) == expected
+
+    features = puzzle_features(puzzle)
+    _, dominoes = encode_puzzles([puzzle])
+    assert features == encoded_puzzle_features(5, puzzle.lights_int, dominoes[0])
+    assert features["total_candidate_boards"] >= 1
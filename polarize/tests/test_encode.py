@@ -10,13 +10,19 @@ from polarize.encode import (
     canonical_boards,
     canonical_puzzles_with_unique_solution,
     canonicalize_board,
+    canonicalize_boards,
     canonicalize_puzzle,
+    count_boards,
     decode_board,
     decode_dominoes,
     decode_puzzle,
+    duplicated_keys,
     encode_board,
     encode_dominoes,
     encode_lights_from_filters,
+    is_sub_multiset,
+    iter_all_boards,
+    num_dominoes,
     reflect_dominoes_horizontally,
     reflect_dominoes_vertically,
     reflect_horizontally,
@@ -27,6 +33,8 @@ from polarize.encode import (
     transpose_dominoes,
     transpose_lights,
     transforms,
+    transforms_dominoes,
+    transforms_lights,
 )
 from polarize.generate import all_boards_with_dominoes
 from polarize.model import ALL_DOMINOES, Board, Puzzle, PlacedDomino
@@ -285,3 +293,77 @@ def test_canonical_puzzles_with_unique_solution():
     for i in range(len(canonical_lights)):
         puzzle = decode_puzzle(canonical_lights[i], canonical_dominoes[i])
         assert has_unique_solution(puzzle)
+
+
+def test_num_dominoes_and_is_sub_multiset():
+    val = encode_dominoes(np.array([2, 6, 6], dtype=np.int8))
+    assert num_dominoes(val) == 3
+    assert_array_equal(num_dominoes(np.array([0, val])), [0, 3])
+
+    subsets = [
+        encode_dominoes(np.array(s, dtype=np.int8))
+        for s in ([], [2], [6], [2, 6], [6, 6], [2, 6, 6])
+    ]
+    for subset in subsets:
+        assert is_sub_multiset(subset, val)
+    assert not is_sub_multiset(val, subsets[1])
+    assert not is_sub_multiset(encode_dominoes(np.array([6, 6, 6], dtype=np.int8)), val)
+
+
+def test_duplicated_keys():
+    keys = np.array([5, 3, 5, 1, 2, 3, 5], dtype=np.uint64)
+    assert_array_equal(
+        duplicated_keys(keys), [True, True, True, False, False, True, True]
+    )
+    assert_array_equal(duplicated_keys(np.array([], dtype=np.uint64)), [])
+
+
+def test_iter_all_boards():
+    for num_pieces in range(0, 4):
+        boards, lights, dominoes = all_boards(num_pieces)
+        assert count_boards(num_pieces) == len(boards)
+
+        chunks = list(iter_all_boards(num_pieces, chunk_size=1000))
+        assert all(len(chunk[0]) <= 1000 for chunk in chunks)
+        for arr, chunk_arrs in zip((boards, lights, dominoes), zip(*chunks)):
+            assert_array_equal(np.concatenate(chunk_arrs), arr)
+
+
+def test_all_boards_parallel():
+    for num_pieces in range(0, 4):
+        boards, lights, dominoes = all_boards(num_pieces)
+        assert count_boards(num_pieces, parallel=True) == len(boards)
+
+        # parallel enumeration produces boards in the same order
+        for arr, arr_parallel in zip(
+            (boards, lights, dominoes), all_boards(num_pieces, parallel=True)
+        ):
+            assert_array_equal(arr_parallel, arr)
+
+        chunks = list(iter_all_boards(num_pieces, chunk_size=1000, parallel=True))
+        for arr, chunk_arrs in zip((boards, lights, dominoes), zip(*chunks)):
+            assert_array_equal(np.concatenate(chunk_arrs), arr)
+
+
+def test_all_boards_canonical():
+    for num_pieces in range(0, 4):
+        boards, _, _ = all_boards(num_pieces)
+        canonical, _, _ = all_boards(num_pieces, canonical=True)
+        assert_array_equal(np.sort(canonical), np.unique(canonicalize_boards(boards)))
+        assert count_boards(num_pieces, canonical=True) == len(canonical)
+
+
+@given(boards())
+def test_transforms_lights_and_dominoes(b):
+    board_val = encode_board(b)
+    lights = encode_lights_from_filters(board_val >> 32 & 0xFFFFFFFF)
+    dominoes = encode_dominoes(
+        np.array([pd.domino.value for pd in b.placed_dominoes], dtype=np.int8)
+    )
+    for tb, tl, td in zip(
+        b.transforms(), transforms_lights(lights), transforms_dominoes(dominoes)
+    ):
+        assert tl == tb.lights_int
+        assert td == encode_dominoes(
+            np.array([pd.domino.value for pd in tb.placed_dominoes], dtype=np.int8)
+        )
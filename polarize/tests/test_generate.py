@@ -1,6 +1,18 @@
-import numpy as np
+from collections import Counter
+from itertools import islice
 
-from polarize.generate import all_boards_with_dominoes, generate, layout
+import numpy as np
+import pytest
+
+from polarize.difficulty import puzzle_features
+from polarize.generate import (
+    REJECTIONS,
+    all_boards_with_dominoes,
+    generate,
+    generate_from_tables,
+    layout,
+    puzzle_generator,
+)
 from polarize.model import ALL_DOMINOES
 from polarize.solve import solve
 
@@ -53,6 +65,15 @@ def test_layout():
     dominoes = [ALL_DOMINOES[2], ALL_DOMINOES[7], ALL_DOMINOES[1]]
     board = layout(4, dominoes)
     assert board is not None
+    assert sorted(pd.domino for pd in board.placed_dominoes) == sorted(dominoes)
+
+    # a full board
+    dominoes = [ALL_DOMINOES[0]] * 4 + [ALL_DOMINOES[4]] * 4
+    board = layout(4, dominoes)
+    assert np.all(board.values != 0)
+
+    # too many vertical dominoes to fit
+    assert layout(3, [ALL_DOMINOES[4]] * 4) is None
 
 
 def test_generate():
@@ -60,3 +81,63 @@ def test_generate():
     solutions = solve(puzzle)
     assert len(solutions) == 1
     assert solutions[0].placed_dominoes == solution.placed_dominoes
+
+
+def test_generate_from_tables():
+    for _ in range(5):
+        puzzle, solution = generate_from_tables(4)
+        assert len(puzzle.dominoes) == 3
+        assert solve(puzzle, fewer_pieces_allowed=True) == [solution]
+
+
+def test_puzzle_generator_is_reproducible():
+    def puzzles(**kwargs):
+        generator = puzzle_generator(4, 3, **kwargs)
+        return [
+            (puzzle.lights_int, puzzle.dominoes) for puzzle, _ in islice(generator, 6)
+        ]
+
+    expected = puzzles(seed=42)
+    assert puzzles(seed=42) == expected
+    assert puzzles(seed=42, workers=2) == expected
+    assert puzzles(seed=43) != expected
+
+
+def test_puzzle_generator_without_forkserver(monkeypatch):
+    # forkserver isn't available on Windows, so spawn is used instead
+    monkeypatch.setattr("multiprocessing.get_all_start_methods", lambda: ["spawn"])
+    generator = puzzle_generator(4, 3, seed=42, workers=2)
+    expected = puzzle_generator(4, 3, seed=42)
+    for (puzzle, _), (expected_puzzle, _) in islice(zip(generator, expected), 2):
+        assert puzzle.lights_int == expected_puzzle.lights_int
+        assert puzzle.dominoes == expected_puzzle.dominoes
+    generator.close()
+
+
+def test_generate_stats():
+    stats = Counter()
+    generator = puzzle_generator(
+        4, 4, seed=42, max_yellow_spots=0, min_distinct_dominoes=4, stats=stats
+    )
+    for puzzle, _ in islice(generator, 3):
+        features = puzzle_features(puzzle)
+        assert features["num_yellow_spots"] == 0
+    assert set(stats) <= set(REJECTIONS)
+    assert stats["too_few_distinct_dominoes"] > 0
+    assert stats["too_many_yellow_spots"] > 0
+
+
+def test_generate_with_constraints():
+    for generate_puzzle in (generate, generate_from_tables):
+        for seed in range(3):
+            puzzle, _ = generate_puzzle(
+                4, 4, rng=seed, max_yellow_spots=1, min_distinct_dominoes=4
+            )
+            features = puzzle_features(puzzle)
+            assert features["num_yellow_spots"] <= 1
+            assert features["num_distinct_dominoes"] == 4
+
+        with pytest.raises(ValueError):
+            generate_puzzle(4, 3, min_distinct_dominoes=4)
+        with pytest.raises(ValueError):
+            generate_puzzle(4, 1, max_yellow_spots=0)
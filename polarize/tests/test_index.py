@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from polarize import encode, model
+from polarize.encode import (
+    all_boards,
+    canonicalize_boards,
+    canonicalize_puzzles,
+    encode_puzzle_keys,
+)
+from polarize.index import (
+    INDEX_FORMAT_VERSION,
+    build_index,
+    encoding_version,
+    index_path,
+    load_canonical_boards,
+    load_puzzle_keys,
+    lookup,
+    source_version,
+)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("POLARIZE_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_load_canonical_boards(cache_dir):
+    assert not index_path(2).exists()
+
+    keys, boards, lights, dominoes = load_canonical_boards(2)
+
+    path = index_path(2)
+    assert path.exists()
+    assert path.parent == cache_dir / encoding_version()
+    for arr in (keys, boards, lights, dominoes):
+        assert isinstance(arr, np.memmap)
+
+    # the index contains one board for each set of boards that are transforms of one another
+    all_board_vals, all_lights, all_dominoes = all_boards(2)
+    assert_array_equal(np.sort(boards), np.unique(canonicalize_boards(all_board_vals)))
+    assert len(boards) < len(all_board_vals) / 7
+
+    # the lights and dominoes are for the canonical boards themselves
+    puzzles = dict(zip(all_board_vals, zip(all_lights, all_dominoes)))
+    for board, li, do in zip(boards, lights, dominoes):
+        assert puzzles[board] == (li, do)
+
+    # the index is sorted by canonical puzzle key
+    assert np.all(keys[:-1] <= keys[1:])
+    assert_array_equal(
+        keys,
+        encode_puzzle_keys(*canonicalize_puzzles(np.array(lights), np.array(dominoes))),
+    )
+
+    # loading again uses the existing index
+    mtime = (path / "boards.npy").stat().st_mtime_ns
+    load_canonical_boards(2)
+    assert (path / "boards.npy").stat().st_mtime_ns == mtime
+
+
+def test_index_is_versioned(cache_dir, monkeypatch):
+    load_canonical_boards(1)
+
+    # a change in encoding means a new index is built
+    monkeypatch.setattr("polarize.index.encoding_version", lambda: "changed")
+    assert not index_path(1).exists()
+    load_canonical_boards(1)
+    assert (cache_dir / "changed" / "puzzles-1").exists()
+
+
+def test_source_version():
+    assert source_version(1, encode, model) == source_version(1, encode, model)
+    assert source_version(1, encode, model) != source_version(2, encode, model)
+    assert source_version(1, encode, model) != source_version(1, encode)
+    assert encoding_version() == source_version(INDEX_FORMAT_VERSION, encode, model)
+
+
+def test_build_index_in_chunks(monkeypatch):
+    build_index(3, chunk_size=1000)
+    small_chunks = load_canonical_boards(3) + load_puzzle_keys(3)
+
+    # build another index from a single chunk, which is the same
+    monkeypatch.setattr("polarize.index.encoding_version", lambda: "single-chunk")
+    build_index(3, chunk_size=None)
+    single_chunk = load_canonical_boards(3) + load_puzzle_keys(3)
+    for arr, expected in zip(small_chunks, single_chunk):
+        assert_array_equal(arr, expected)
+
+    _, boards, _, _, _, _ = small_chunks
+    assert_array_equal(np.sort(boards), np.sort(all_boards(3, canonical=True)[0]))
+
+
+def test_load_puzzle_keys():
+    keys, _, _, _ = load_canonical_boards(3)
+    puzzle_keys, puzzle_offsets = load_puzzle_keys(3)
+
+    assert_array_equal(puzzle_keys, np.unique(keys))
+    assert len(puzzle_offsets) == len(puzzle_keys) + 1
+    for i in (0, len(puzzle_keys) // 2, len(puzzle_keys) - 1):
+        start, end = lookup(keys, puzzle_keys[i])
+        assert (start, end) == tuple(puzzle_offsets[i : i + 2])
+
+
+def test_lookup():
+    keys, _, _, _ = load_canonical_boards(2)
+    for i in (0, len(keys) // 2, len(keys) - 1):
+        start, end = lookup(keys, keys[i])
+        assert_array_equal(keys[start:end], keys[i])
+        assert start <= i < end
+
+    assert lookup(keys, 0) == (0, 0)
+
+    # many keys can be looked up at once
+    query = keys[[0, len(keys) // 2, len(keys) - 1]]
+    starts, ends = lookup(keys, query)
+    for key, start, end in zip(query, starts, ends):
+        assert (start, end) == lookup(keys, key)
@@ -1,3 +1,5 @@
+import pickle
+
 import numpy as np
 from numpy.testing import assert_array_equal
 import pytest
@@ -5,12 +7,15 @@ from rich.console import Console
 
 from polarize.model import (
     Board,
+    Domino,
     Filter,
     Orientation,
     PlacedDomino,
     Puzzle,
     ALL_DOMINOES,
+    count_lights,
     decode_lights,
+    placement_table,
 )
 
 
@@ -41,6 +46,30 @@ def test_all_dominoes():
         assert ALL_DOMINOES[i] < ALL_DOMINOES[i + 1]
 
 
+def test_dominoes_are_interned():
+    domino = Domino(Orientation.V, Filter.NEG_45, Filter.POS_45)
+    assert domino is ALL_DOMINOES[6]
+    assert domino.value == 6
+    assert hash(domino) == 6
+    assert domino.T is ALL_DOMINOES[2]
+    assert pickle.loads(pickle.dumps(domino)) is domino
+    assert repr(domino) == (
+        "Domino(orientation=<Orientation.V: 2>, "
+        "filter1=<Filter.NEG_45: 2>, filter2=<Filter.POS_45: 1>)"
+    )
+    with pytest.raises(AttributeError):
+        domino.filter1 = Filter.POS_45
+
+    pd = PlacedDomino(domino, 1, np.int64(2))
+    assert pd is PlacedDomino(ALL_DOMINOES[6], 1, 2)
+    assert pd.T is PlacedDomino(ALL_DOMINOES[2], 2, 1)
+    assert type(pd.y) is int
+    assert pickle.loads(pickle.dumps(pd)) is pd
+    assert {pd, PlacedDomino(domino, 1, 2)} == {pd}
+    with pytest.raises(AttributeError):
+        pd.x = 0
+
+
 def test_add_domino():
     board = Board()
 
@@ -112,6 +141,36 @@ def test_transforms(board):
             assert board.placed_dominoes != boardTransformed.placed_dominoes
 
 
+def test_transforms_match_composition(board):
+    # the transforms of a 4x4 board are computed with the encode kernels, which should
+    # match composing the individual transforms
+    rotations = [board]
+    for _ in range(3):
+        rotations.append(rotations[-1].rot90())
+    transposes = [board.transpose()]
+    for _ in range(3):
+        transposes.append(transposes[-1].rot90())
+    assert list(board.transforms()) == rotations + transposes
+
+
+def test_transforms_size_5():
+    board = Board(n=5)
+    board.add_domino(PlacedDomino(ALL_DOMINOES[1], 0, 0))
+    board.add_domino(PlacedDomino(ALL_DOMINOES[6], 4, 1))
+    board.add_domino(PlacedDomino(ALL_DOMINOES[5], 1, 3))
+
+    transforms = list(board.transforms())
+    assert transforms[0] == board
+    assert len(set(transforms)) == 8
+    for transformed in transforms:
+        assert transformed.n == 5
+        assert len(transformed.placed_dominoes) == 3
+        assert sorted(transformed.lights) == sorted(board.lights)
+        # reflecting twice is the identity
+        assert transformed.reflect_vertically().reflect_vertically() == transformed
+        assert transformed.transpose().transpose() == transformed
+
+
 def test_board_to_puzzle():
     board = Board()
     board.add_domino(PlacedDomino(ALL_DOMINOES[2], 0, 2))
@@ -188,3 +247,57 @@ def test_board_to_puzzle_size_3():
     # print the puzzle
     console = Console()
     console.print(puzzle)
+
+
+@pytest.mark.parametrize("n", [3, 4, 5])
+def test_placement_table(n):
+    table = placement_table(n)
+    assert len(table) == 8 * n * (n - 1)
+    for pd, placement in table.items():
+        board = Board(n)
+        board.add_domino(pd)
+        assert placement.filters == board.filter_bits
+        assert placement.orientations == board.orientation_bits
+        assert placement.mask & board.filter_bits == board.filter_bits
+        assert bin(placement.mask).count("1") == 4
+        assert count_lights(placement.light_filters) == board.lights_int
+
+
+def test_lights_are_maintained_incrementally():
+    def expected_lights(board):
+        hi = np.bitwise_count(np.bitwise_or.reduce(board.values, axis=1))
+        lo = np.bitwise_count(np.bitwise_or.reduce(board.values, axis=0))
+        return np.concatenate([hi, lo])
+
+    pds = [
+        PlacedDomino(ALL_DOMINOES[2], 0, 2),
+        PlacedDomino(ALL_DOMINOES[6], 2, 2),
+        PlacedDomino(ALL_DOMINOES[1], 1, 0),
+        PlacedDomino(ALL_DOMINOES[4], 3, 0),
+    ]
+    board = Board(n=5)
+    for pd in pds:
+        board.add_domino(pd)
+        assert_array_equal(board.lights, expected_lights(board))
+    for pd in pds[1::2]:
+        board.remove_domino(pd)
+        assert_array_equal(board.lights, expected_lights(board))
+
+    # a board created from bits counts its lights when they are first needed
+    copy = Board.from_bits(5, board.filter_bits, board.orientation_bits)
+    assert copy.lights_int == board.lights_int
+    copy.remove_domino(pds[0])
+    assert_array_equal(copy.lights, expected_lights(copy))
+
+
+def test_pickle_board():
+    board = Board(n=5)
+    board.add_domino(PlacedDomino(ALL_DOMINOES[2], 0, 2))
+    data = pickle.dumps(board)
+    assert len(data) < 1000  # the placement table isn't pickled
+
+    copy = pickle.loads(data)
+    assert copy == board
+    assert copy._placements is placement_table(5)
+    copy.add_domino(PlacedDomino(ALL_DOMINOES[6], 2, 2))
+    assert copy.lights_int != board.lights_int
@@ -1,5 +1,20 @@
-from polarize.model import Puzzle
-from polarize.solve import has_unique_solution, quick_has_unique_solution
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from polarize.encode import decode_board, encode_puzzles
+from polarize.generate import all_boards_with_dominoes
+from polarize.model import ALL_DOMINOES, Board, PlacedDomino, Puzzle
+from polarize.solve import (
+    count_solutions,
+    has_unique_solution,
+    quick_count_solutions,
+    quick_count_solutions_many,
+    quick_has_unique_solution,
+    quick_has_unique_solution_many,
+    quick_solve,
+    quick_solve_many,
+    solve,
+)
 
 
 def test_solve_unique():
@@ -20,6 +35,50 @@ def test_solve_not_unique_with_fewer_pieces():
     assert not has_unique_solution(puzzle, fewer_pieces_allowed=True)
 
 
+def test_solve_matches_brute_force():
+    dominoes = [ALL_DOMINOES[0], ALL_DOMINOES[3], ALL_DOMINOES[6]]
+    boards = list(all_boards_with_dominoes(n=4, dominoes=dominoes))
+    for board in boards[::50]:
+        puzzle = Puzzle(4, board.lights, dominoes, [], board)
+        expected = [b for b in boards if b.lights_int == board.lights_int]
+        solutions = solve(puzzle)
+        assert len(solutions) == len(expected)
+        assert set(solutions) == set(expected)
+
+
+def test_solve_larger_board():
+    board = Board(n=5)
+    for d, x, y in ((0, 0, 0), (7, 4, 0), (2, 2, 2), (5, 1, 3), (3, 3, 4)):
+        board.add_domino(PlacedDomino(ALL_DOMINOES[d], x, y))
+    dominoes = [pd.domino for pd in board.placed_dominoes]
+    puzzle = Puzzle(5, board.lights, dominoes, [], board)
+
+    solutions = solve(puzzle)
+    assert board in solutions
+    assert len(set(solutions)) == len(solutions)
+    for solution in solutions:
+        assert solution.lights_int == puzzle.lights_int
+        assert sorted(pd.domino for pd in solution.placed_dominoes) == sorted(dominoes)
+
+
+def test_count_solutions():
+    board = Board(n=4)
+    for x, y in ((0, 0), (2, 0), (0, 1)):
+        board.add_domino(PlacedDomino(ALL_DOMINOES[0], x, y))
+    puzzle = board.to_puzzle()
+    num_solutions = len(solve(puzzle, fewer_pieces_allowed=True))
+    assert num_solutions > 2
+
+    for limit in (1, 2, num_solutions + 1):
+        expected = min(limit, num_solutions)
+        assert count_solutions(puzzle, limit, fewer_pieces_allowed=True) == expected
+        assert (
+            quick_count_solutions(puzzle, limit, fewer_pieces_allowed=True) == expected
+        )
+    assert count_solutions(puzzle, None, fewer_pieces_allowed=True) == num_solutions
+    assert count_solutions(puzzle, None) == len(solve(puzzle))
+
+
 def test_quick_solve_unique():
     # set on 20 Jan 2025
     puzzle = Puzzle.from_json_str(
@@ -36,3 +95,65 @@ def test_quick_solve_not_unique_with_fewer_pieces():
     )
     assert quick_has_unique_solution(puzzle)
     assert not quick_has_unique_solution(puzzle, fewer_pieces_allowed=True)
+
+
+def test_quick_solve_many():
+    puzzles = [
+        # set on 20 Jan 2025
+        Puzzle.from_json_str(
+            """{"n": 4, "lights": [2, 2, 1, 1, 0, 2, 2, 1], "dominoes": [5, 0, 5, 1], "initial_placed_dominoes": [{"domino": 5, "i": 0, "j": 0}, {"domino": 0, "i": 2, "j": 0}, {"domino": 5, "i": 1, "j": 0}, {"domino": 1, "i": 2, "j": 1}], "solution": {"values": [[0, 1, 1, 2], [0, 2, 1, 0], [0, 0, 2, 0], [0, 1, 1, 0]], "placed_dominoes": [{"domino": 1, "i": 2, "j": 0}, {"domino": 0, "i": 1, "j": 3}, {"domino": 5, "i": 2, "j": 1}, {"domino": 5, "i": 1, "j": 0}]}}"""
+        ),
+        # set on 18 Jan 2025
+        Puzzle.from_json_str(
+            """{"n": 4, "lights": [2, 0, 1, 2, 1, 1, 2, 2], "dominoes": [4, 2, 1, 3], "initial_placed_dominoes": [{"domino": 1, "i": 1, "j": 1}, {"domino": 2, "i": 1, "j": 0}, {"domino": 4, "i": 0, "j": 0}, {"domino": 3, "i": 0, "j": 2}], "solution": {"values": [[0, 0, 1, 2], [0, 0, 0, 0], [2, 2, 0, 0], [0, 0, 2, 1]], "placed_dominoes": [{"domino": 1, "i": 2, "j": 0}, {"domino": 2, "i": 2, "j": 3}, {"domino": 3, "i": 0, "j": 2}]}}"""
+        ),
+        # set on 11 Jan 2025
+        Puzzle.from_json_str(
+            """{"n": 4, "lights": [1, 2, 2, 0, 0, 1, 2, 2], "dominoes": [2, 6, 6], "initial_placed_dominoes": [{"domino": 6, "i": 0, "j": 0}, {"domino": 2, "i": 2, "j": 0}, {"domino": 6, "i": 1, "j": 0}], "solution": {"values": [[0, 0, 2, 0], [0, 0, 1, 2], [0, 2, 1, 1], [0, 0, 0, 0]], "placed_dominoes": [{"domino": 2, "i": 1, "j": 2}, {"domino": 6, "i": 3, "j": 1}, {"domino": 6, "i": 2, "j": 0}]}}"""
+        ),
+    ]
+    lights_vals, dominoes_vals = encode_puzzles(puzzles)
+
+    for fewer_pieces_allowed in (False, True):
+        counts, boards = quick_solve_many(
+            lights_vals, dominoes_vals, fewer_pieces_allowed=fewer_pieces_allowed
+        )
+        assert len(boards) == np.sum(counts)
+        offsets = np.cumsum(counts) - counts
+        for i, puzzle in enumerate(puzzles):
+            expected = quick_solve(puzzle, fewer_pieces_allowed=fewer_pieces_allowed)
+            assert counts[i] == len(expected)
+            puzzle_boards = boards[offsets[i] : offsets[i] + counts[i]]
+            assert set(decode_board(b) for b in puzzle_boards) == set(expected)
+            assert set(expected) == set(
+                solve(puzzle, fewer_pieces_allowed=fewer_pieces_allowed)
+            )
+
+        for limit in (1, 2, 3, None):
+            expected = np.minimum(counts, limit) if limit is not None else counts
+            assert_array_equal(
+                quick_count_solutions_many(
+                    lights_vals,
+                    dominoes_vals,
+                    limit,
+                    fewer_pieces_allowed=fewer_pieces_allowed,
+                ),
+                expected,
+            )
+
+    assert_array_equal(
+        quick_has_unique_solution_many(lights_vals, dominoes_vals), [True, True, True]
+    )
+    assert_array_equal(
+        quick_has_unique_solution_many(
+            lights_vals, dominoes_vals, fewer_pieces_allowed=True
+        ),
+        [True, False, True],
+    )
+
+
+def test_solve_fewer_pieces_includes_empty_board():
+    board = Board(n=4)
+    puzzle = Puzzle(4, board.lights, [ALL_DOMINOES[0], ALL_DOMINOES[5]], [], board)
+    assert solve(puzzle) == []
+    assert solve(puzzle, fewer_pieces_allowed=True) == [board]
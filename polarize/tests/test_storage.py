@@ -1,5 +1,29 @@
-from polarize.generate import generate
-from polarize.storage import load_puzzle, save_puzzle
+import json
+
+import pytest
+
+from polarize import bitboard, encode, model
+from polarize.generate import generate, generate_from_tables, unique_solution_boards
+from polarize.index import source_version
+from polarize.storage import (
+    ARCHIVE_INDEX_FORMAT_VERSION,
+    ArchiveIndex,
+    _archive_index,
+    archive_index,
+    archive_index_path,
+    archive_index_version,
+    canonical_puzzle_key,
+    load_puzzle,
+    save_puzzle,
+)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("POLARIZE_CACHE_DIR", str(tmp_path / "cache"))
+    _archive_index.cache_clear()
+    yield tmp_path / "cache"
+    _archive_index.cache_clear()
 
 
 def test_storage(tmp_path):
@@ -8,3 +32,69 @@ def test_storage(tmp_path):
     filename = tmp_path / "puzzle.json"
     save_puzzle(puzzle, filename)
     load_puzzle(filename)
+
+
+def test_canonical_puzzle_key():
+    puzzle, solution = generate_from_tables(4, rng=42)
+    key = canonical_puzzle_key(puzzle)
+    for board in solution.transforms():
+        assert canonical_puzzle_key(board.to_puzzle()) == key
+
+
+def test_archive_index(tmp_path, cache_dir):
+    puzzles_dir = tmp_path / "puzzles"
+    puzzles_dir.mkdir()
+    puzzles = [generate_from_tables(4, rng=seed) for seed in range(4)]
+    for i, (puzzle, _) in enumerate(puzzles[:3]):
+        save_puzzle(puzzle, puzzles_dir / f"puzzle-2030-01-0{i + 1}.json")
+
+    # no index exists until it is used
+    assert not archive_index_path(puzzles_dir).exists()
+    archive = archive_index(puzzles_dir)
+    assert archive_index_path(puzzles_dir).exists()
+    assert len(archive) == 3
+
+    # puzzles are found in any orientation
+    for puzzle, solution in puzzles[:3]:
+        assert puzzle in archive
+        for board in solution.transforms():
+            assert board.to_puzzle() in archive
+    new_puzzle = puzzles[3][0]
+    assert new_puzzle not in archive
+
+    # saving a puzzle updates the index, in memory and on disk
+    save_puzzle(new_puzzle, puzzles_dir / "puzzle-2030-01-04.json")
+    assert new_puzzle in archive
+    with open(archive_index_path(puzzles_dir)) as f:
+        assert "puzzle-2030-01-04.json" in json.load(f)
+
+    # files that are removed are dropped from the index when it is loaded again
+    (puzzles_dir / "puzzle-2030-01-01.json").unlink()
+    archive = ArchiveIndex(puzzles_dir)
+    assert puzzles[0][0] not in archive
+    assert new_puzzle in archive
+
+
+def test_archive_index_is_versioned(tmp_path, cache_dir, monkeypatch):
+    # the keys are computed by bitboard.py, so it is part of the version
+    assert archive_index_version() == source_version(
+        ARCHIVE_INDEX_FORMAT_VERSION, bitboard, encode, model
+    )
+    path = archive_index_path(tmp_path)
+    assert path.parent == cache_dir / "archives" / archive_index_version()
+
+    # a change in the keys means a new index is built
+    monkeypatch.setattr("polarize.storage.archive_index_version", lambda: "changed")
+    assert archive_index_path(tmp_path) != path
+    assert archive_index_path(tmp_path).parent.name == "changed"
+
+
+def test_generate_excludes_archived_puzzles():
+    keys, _, _, _ = unique_solution_boards(1)
+    exclude = {(4, int(key)) for key in keys[1:]}
+    for seed in range(5):
+        puzzle, _ = generate_from_tables(4, 1, rng=seed, exclude=exclude)
+        assert canonical_puzzle_key(puzzle) == (4, int(keys[0]))
+
+        puzzle, _ = generate(4, 1, rng=seed, exclude=exclude)
+        assert canonical_puzzle_key(puzzle) not in exclude